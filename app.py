@@ -1,462 +1,343 @@
-from flask import Flask, render_template, request, current_app, send_from_directory, session
+from flask import Flask, Response, abort, after_this_request, jsonify, redirect, render_template, request, \
+    send_from_directory, session, stream_with_context, url_for
+import cProfile
+import io
+import json
+import logging
+import mimetypes
 import os
 import numpy as np
 import pandas as pd
-import sys
+import time
+
+import build_assets
+from fair_fill import check_limits
+from itineraries import parse_formats, parse_start, stream_itineraries
+from jobs import ACTIVE, JOB_TIMEOUT, ProgressReporter, is_active, mark_queued, read_status, run_inline, submit
+from local_search import improve_schedule
+import metrics
+from pipeline import BACKUP_WEIGHT, apply_late_changes, build_entity_index, clean_up_requests, create_schedule, \
+    fill_schedule, fill_until_tie, get_requests_from_data, read_event, run_fair_fill, run_optimal_fill
+from reschedule import read_added_requests
+from result_cache import content_key, make_result_cache
+from schedule_check import check_schedule, describe_problems, entity_types, make_check
+from slot_engine import SlotEngine
+from state_store import make_state_store
+from tie_cursor import TieCursor
+from tie_policies import TIE_POLICIES, get_tie_policy
+from unavailability import apply_unavailability, describe_report, read_unavailability
+from workspace import collect_stale_jobs, create_job, job_dir, job_path, locked
 
 app = Flask(__name__)
 app.secret_key = 'secretsecrekeykey'
 
 UPLOAD_FOLDER = os.path.basename('uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-max_tie_break = 100
-original_filename = ''
-
-
-def get_requests_from_data(df):
-    df = df.replace(np.nan, '', regex=True)
-
-    selections = [s for s in list(df) if '_' in s]
-
-    col_names = ['entity'] + selections + ['type']
-    df_requests = df[col_names].copy()
-
-    # Delete duplicate requests (one entity requesting the same other entity multiple times)
-    def delete_duplicate_requests(r):
-        to_overwrite = r[r.duplicated()].keys().tolist()
-        r[to_overwrite] = ''
-        return r
-
-    df_requests.apply(delete_duplicate_requests, axis=1)
-
-    main_choices_indices = [i for i, s in enumerate(list(df_requests)) if 'choice_' in s]
-    backup_choices_indices = [i for i, s in enumerate(list(df_requests)) if 'backup_' in s]
-
-    # Flatten so each request is its own row
-    requests = []
-    for _, row in df_requests.iterrows():
-        for col in main_choices_indices + backup_choices_indices:
-            # print(row)
-            # print(col)
-            reqd = row[col]
-            # print(reqd)
-            if reqd == '':
-                continue
-            try:
-                reqd_type = df[df['entity'] == reqd].iloc[0]['type']
-            except IndexError:
-                print(f'The entity %{reqd} does not exist in the spreadsheet, so it\'s being skipped.')
-                continue
-            multiplier = 1.0 if col in main_choices_indices else 0.5  # change 0.5 to 0.25?
-            requests.append([row['entity'], reqd, multiplier, row['type'], reqd_type])
-
-    col_names = ['requester', 'requested', 'multiplier', 'reqr_type', 'reqd_type']
-    df_request_pairs = pd.DataFrame(requests, columns=col_names)
-
-    def calculate_choice_score(row_ind):
-        """Calculate score for each request and add it as a new column"""
-        requester = df_request_pairs.at[row_ind.name, 'requester']
-        requested = df_request_pairs.at[row_ind.name, 'requested']
-        importance_requester = df[df['entity'] == requester].iloc[0]['importance']
-        importance_requested = df[df['entity'] == requested].iloc[0]['importance']
-
-        # print(f'{requester} x {requested} score is {importance_requested * importance_requester}')
-        return df_request_pairs.at[row_ind.name, 'multiplier'] * importance_requester * importance_requested
-
-    df_request_pairs['score'] = df_request_pairs.apply(calculate_choice_score, axis=1)
-
-    return df_request_pairs, df_requests, len(main_choices_indices)
-
-
-def clean_up_requests(df_request_pairs):
-    # Delete any company-company and investor-investor meetings
-    df_request_pairs['type_total'] = df_request_pairs['reqr_type'] + df_request_pairs['reqd_type']
-    df_request_pairs = df_request_pairs[df_request_pairs['type_total'] == 1]
-    # print(f'Deleted all same-type meetings:\n{df_request_pairs.head()}')
-
-    # Take care of duplicate meetings (add scores if both ppl wanted to meet)
-    df_requests_co_first = df_request_pairs[df_request_pairs['reqr_type'] == 0]
-    # NOTE: this means all meetings in the requests df MUST be actual requests. Can't add in all possibilities.
-    df_requests_co_first = df_requests_co_first.assign(co_req=True)  # doesn't differentiate backup choices
-    df_requests_inv_first = df_request_pairs[df_request_pairs['reqr_type'] == 1]
-    df_requests_inv_first = df_requests_inv_first.assign(co_req=False)
-    # print(f'Make sure sizes match: {df_requests_co_first.shape[0] + df_requests_inv_first.shape[0]} '
-    #       f'= {df_request_pairs.shape[0]}')
-    if (df_requests_co_first.shape[0] + df_requests_inv_first.shape[0]) != df_request_pairs.shape[0]:
-        print('Error in code - investor + company requests do not match for final dataframe')
-        sys.exit()
-
-    # Reverse all inv_first
-    df_requests_inv_first.rename(columns={'requested': 'requester', 'requester': 'requested'}, inplace=True)
-    df_requests_inv_first.loc[:, ('reqr_type', 'reqd_type')] = [0, 1]
-    # combine again
-    df_requests_combined = df_requests_co_first.append(df_requests_inv_first)
-    # Add scores together; NOTE: this is also summing reqr_type type_total, reqd_type, multiplier cols
-    df_requests_combined = df_requests_combined.groupby(['requested', 'requester']).sum().reset_index()
-
-    # Sort input matrix by score.
-    df_requests_combined_sorted = df_requests_combined.sort_values(by=['score'], ascending=False)
-    df_requests_combined_sorted.rename(columns={'requested': 'entity2', 'requester': 'entity1'}, inplace=True)
-    df_requests_combined_sorted = df_requests_combined_sorted.assign(scheduled=False)
-    # print(df_requests_combined_sorted.head())
-    # Reorder everything based on our preferences (e.g. if two meetings have the same score)
-
-    return df_requests_combined_sorted
-
-
-def create_schedule(df, num_meetings):
-    df_schedule = df[['entity']].copy()
-    df_schedule = df_schedule.drop_duplicates(subset=['entity'])
-
-    for ind in range(1, num_meetings + 1):
-        df_schedule['mtg' + str(ind)] = ''
-        # mtg#_req represents if that person requested that meeting or not
-        df_schedule['mtg' + str(ind) + '_req'] = False
-
-    return df_schedule
-
-
-def schedule_over_unavailability(df_schedule, entity, conflicts_str):
-    # print('Let\'s block out times when attendees are unavailable!')
-    more = True
-    while more:
-        if entity == 'DONE':
-            # more = False
-            break
-
-        # Catch error where entity name doesn't match
-        try:
-            entity_row = df_schedule.index[df_schedule['entity'] == entity].tolist()[0]
-        except IndexError:
-            print('That entity name doesn\'t match with anything in your spreadsheet. '
-                  'Please check the name and remember that spaces matter!')
-            continue
-
-        # conflicts_str = input(f"Which meetings can't {entity} make? "
-        #                       f"(format should be \'#\' or \'#,#\'; "
-        #                       f"e.g. if they can't make meetings 1 and 3, enter \'1,3\'\n")
-        conflicts = map(int, conflicts_str.split(','))
-
-        try:
-            for conflict in conflicts:
-                index2 = df_schedule.columns.get_loc('mtg' + str(conflict))
-                df_schedule.iloc[entity_row, index2] = "N/A"
-        except ValueError:
-            print(f'Whoops! I can\'t process {conflicts}, might\'ve been invalid formatting. Let\'s try that again.')
-            continue
-        except KeyError:
-            print(f'Whoops! Looks like one or more of the meetings you entered ({conflicts}) '
-                  f'doesn\'t exist according to your csv. Let\'s try that again.')
-            continue
-
-    return df_schedule
-
-
-def fill_schedule_old(df_schedule, df_requests_combined_sorted, df_requests, df):
-    # includes tie-breaking
-    grouped_by_score = df_requests_combined_sorted.groupby('score', sort=False)
-
-    for name, group in grouped_by_score:
-        # pull out all matches (any non matches are moved up to the top of the list)
-        duplicates1 = group.duplicated(subset='entity1', keep=False).tolist()
-        duplicates2 = group.duplicated(subset='entity2', keep=False).tolist()
-        duplicates_boolean = [a or b for a, b in zip(duplicates1, duplicates2)]
-        singles_boolean = [not i for i in duplicates_boolean]
-
-        duplicates_inds = [i for (i, v) in zip(group.index.values.tolist(), duplicates_boolean) if v]
-        singles_inds = [i for (i, v) in zip(group.index.values.tolist(), singles_boolean) if v]
-
-        # for those, delete if either entity1 or entity2 has no free columns
-        for ind in duplicates_inds:
-            entity1 = group.loc[ind]['entity1']
-            entity2 = group.loc[ind]['entity2']
-            entity1_row = df_schedule.index[df['entity'] == entity1].tolist()[0]
-            entity2_row = df_schedule.index[df['entity'] == entity2].tolist()[0]
-            entity1_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity1_row] == '') if x]
-            entity2_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity2_row] == '') if x]
-
-            if len(entity1_open_cols) == 0 | len(entity2_open_cols) == 0:
-                duplicates_inds.remove(ind)
-
-        # do a check to get rid of singles within duplicates_inds (caused by deleting those with no free columns)
-        duplicates1_2 = group.loc[duplicates_inds, :].duplicated(subset='entity1', keep=False).tolist()
-        duplicates2_2 = group.loc[duplicates_inds, :].duplicated(subset='entity2', keep=False).tolist()
-        duplicates_boolean_2 = [a or b for a, b in zip(duplicates1_2, duplicates2_2)]
-        duplicates_inds = [i for (i, v) in zip(group.index.values.tolist(), duplicates_boolean_2) if v]
-
-        # ask for new order
-        if len(duplicates_inds) > 0:
-            print('-----------------------------------------------')
-            print(group.loc[duplicates_inds, ['entity2', 'entity1']])
-            var = input(
-                "I need your help breaking ties! Reorder the above meeting pairs with most important mtgs "
-                "first using the row index (the first number in each row). (format: \'1,2,3\' or \'1\' or "
-                "\'1,3\') Or type \'SAME\' if it's already in the order you want. \n")
-
-            # todo try to find a way to do a separated sort by entity involved? how to order that?
-
-            try:
-                if var == 'SAME':
-                    new_order_dupl = duplicates_inds
-                else:
-                    # Change order in the original df
-                    new_order_dupl = [int(s) for s in var.split(',')]  # .strip('[]')
-            except ValueError:
-                print(f'Oops, looks like there are some formatting errors in what you typed ({var}). '
-                      f'I\'m going to exit so we can start over.')
-                sys.exit()
-        else:
-            new_order_dupl = duplicates_inds
-
-        new_order = singles_inds + new_order_dupl
-        group = group.reindex(new_order)
-
-        # in order of matrix, schedule meetings.
-        for ind, row in group.iterrows():
-            # print(ind)
-            entity1 = row['entity1']  # all companies are entity1; inv are entity2
-            entity2 = row['entity2']
-            try:
-                entity1_row = df_schedule.index[df['entity'] == entity1].tolist()[0]
-                entity2_row = df_schedule.index[df['entity'] == entity2].tolist()[0]
-            except IndexError:
-                print(f'Oops, looks like one or more of the numbers in {var} might be wrong.')
-                sys.exit()
-            entity1_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity1_row] == '') if x]
-            entity2_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity2_row] == '') if x]
-
-            try:
-                # open_col = set(entity1_open_cols).intersection(entity2_open_cols).pop()
-                # print(df_schedule.iloc[entity1_row])
-                # print(df_schedule.iloc[entity2_row])
-                open_col = min(set(entity1_open_cols).intersection(entity2_open_cols))
-
-            except AttributeError:
-                continue
-
-            except ValueError:
-                continue
-
-            df_schedule.iloc[entity1_row, open_col] = entity2
-            df_schedule.iloc[entity2_row, open_col] = entity1
-            df_requests_combined_sorted.loc[ind, 'scheduled'] = True
-
-            # Mark if the entity requested that meeting; NOTE: includes backups
-            entity1_requests = df_requests[df_requests['entity'] == entity1].values
-            df_schedule.iloc[entity1_row, open_col + 1] = entity2 in entity1_requests
-            entity2_requests = df_requests[df_requests['entity'] == entity2].values
-            df_schedule.iloc[entity2_row, open_col + 1] = entity1 in entity2_requests
-
-    return df_schedule, df_requests_combined_sorted
-
-
-def offer_reorder(df_schedule, df_requests_combined_sorted, df, tie_break):
-    global max_tie_break
-    # includes tie-breaking
-
-    grouped_by_score = df_requests_combined_sorted.groupby('score', sort=True)
-    groups = [name for name, dfs in grouped_by_score]
-    max_tie_break = len(groups)
-
-    print('groups:')
-    print(groups)
-
-    group = grouped_by_score.get_group(groups[-(tie_break+1)])
-
-    # pull out all matches (any non matches are moved up to the top of the list)
-    duplicates1 = group.duplicated(subset='entity1', keep=False).tolist()
-    duplicates2 = group.duplicated(subset='entity2', keep=False).tolist()
-    duplicates_boolean = [a or b for a, b in zip(duplicates1, duplicates2)]
-
-    duplicates_inds = [i for (i, v) in zip(group.index.values.tolist(), duplicates_boolean) if v]
-    print(duplicates_inds)
-
-    # for those, delete if either entity1 or entity2 has no free columns
-    for ind in duplicates_inds:
-        entity1 = group.loc[ind]['entity1']
-        entity2 = group.loc[ind]['entity2']
-        entity1_row = df_schedule.index[df['entity'] == entity1].tolist()[0]
-        entity2_row = df_schedule.index[df['entity'] == entity2].tolist()[0]
-        entity1_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity1_row] == '') if x]
-        entity2_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity2_row] == '') if x]
-        print(df_schedule.iloc[entity1_row])
-        print(entity1_open_cols)
-        print(df_schedule.iloc[entity2_row])
-        print(entity2_open_cols)
-
-        if len(entity1_open_cols) == 0 or len(entity2_open_cols) == 0:
-            duplicates_inds.remove(ind)
-            print(str(ind) + '\'s schedule is full and will be deleted')
-        # delete any companies that can't possibly match
-        if len(set(entity1_open_cols).intersection(entity2_open_cols)) == 0:
-            if ind in duplicates_inds:
-                duplicates_inds.remove(ind)
-            print(str(ind) + ' has no common availability and will be deleted')
-
-    # do a check to get rid of singles within duplicates_inds (caused by deleting those with no free columns)
-    duplicates1_2 = group.loc[duplicates_inds, :].duplicated(subset='entity1', keep=False).tolist()
-    duplicates2_2 = group.loc[duplicates_inds, :].duplicated(subset='entity2', keep=False).tolist()
-    # print(duplicates1_2)
-    # print(duplicates2_2)
-    duplicates_boolean_2 = [a or b for a, b in zip(duplicates1_2, duplicates2_2)]
-    duplicates_inds_2 = [i for (i, v) in zip(
-        group.loc[duplicates_inds, :].index.values.tolist(), duplicates_boolean_2) if v]
-    print(duplicates_inds_2)
-
-    tie_break = tie_break + 1
-
-    # ask for new order
-    if len(duplicates_inds_2) > 0:
-        # todo try to find a way to do a separated sort by entity involved? how to order that?
-        # todo for the future, could also output how many slots each company has or order by company/investor name
-        print(str(group.loc[duplicates_inds_2, ['entity2', 'entity1']]))
-        return str(group.loc[duplicates_inds_2, ['entity2', 'entity1']]), \
-               str(group.loc[duplicates_inds_2].index.values.tolist()).replace(']', '').replace('[', ''), tie_break
-
-    else:
-        return None, None, tie_break
-        # new_order_dupl = duplicates_inds
-
-
-def fill_schedule(df_schedule, df_requests_combined_sorted, df_requests, df, var, tie_break):
-    # includes tie-breaking
-    grouped_by_score = df_requests_combined_sorted.groupby('score', sort=True)
-    groups = [name for name, dfs in grouped_by_score]
-    print('fill_schedule groups:')
-    print(groups)
-
-    group = grouped_by_score.get_group(groups[-tie_break])
-
-    duplicates1 = group.duplicated(subset='entity1', keep=False).tolist()
-    duplicates2 = group.duplicated(subset='entity2', keep=False).tolist()
-    duplicates_boolean = [a or b for a, b in zip(duplicates1, duplicates2)]
-    singles_boolean = [not i for i in duplicates_boolean]
-    singles_inds = [i for (i, v) in zip(group.index.values.tolist(), singles_boolean) if v]
-    duplicates_inds = [i for (i, v) in zip(group.index.values.tolist(), duplicates_boolean) if v]
-
+# 'memory' keeps scheduling state in this process (one worker only); 'disk' shares it between gunicorn workers
+app.config['STATE_BACKEND'] = os.environ.get('STATE_BACKEND', 'disk')
+# job workspaces (uploads/<job id>/) untouched for this many seconds are deleted
+app.config['WORKSPACE_TTL'] = int(os.environ.get('WORKSPACE_TTL', 24 * 60 * 60))
+
+# run the fill loop in a process pool (polled through /jobs/<job id>) instead of inside the HTTP request
+app.config['BACKGROUND_JOBS'] = os.environ.get('BACKGROUND_JOBS', '1') == '1'
+app.config['JOB_WORKERS'] = int(os.environ['JOB_WORKERS']) if os.environ.get('JOB_WORKERS') else None
+# a job still queued or running this many seconds after it was submitted is reported as failed
+app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', JOB_TIMEOUT))
+
+# check the schedule for asymmetric or double-booked meetings (and the like) after every score group is filled
+app.config['CHECK_FILL'] = os.environ.get('CHECK_FILL', '1') == '1'
+
+# set PROFILE_JOBS=1 to save a cProfile dump of every fill job in its folder (profile-<timestamp>.pstats)
+app.config['PROFILE_JOBS'] = os.environ.get('PROFILE_JOBS', '0') == '1'
+
+state_store = make_state_store(app.config['STATE_BACKEND'], UPLOAD_FOLDER)
+
+# replays of the same spreadsheet, unavailability and tie-break answers are served from RESULT_CACHE_DIR (least
+# recently used results go past this many MB; 0 turns the cache off). It sits next to uploads/, not inside it, so
+# the pickled states are never reachable through the download route
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', 'result_cache')
+app.config['RESULT_CACHE_MB'] = int(os.environ.get('RESULT_CACHE_MB', 512))
+result_cache = make_result_cache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MB'])
+
+# LOG_LEVEL=DEBUG brings back the per-group dumps (tied rows, deleted pairs, tie orders)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger('mezzo_match')
+
+
+def form_number(values, field, label, cast=float, default=None, minimum=0, maximum=None):
+    """A number typed into a form field (default when it's left blank), or a ValueError naming the field."""
+    text = (values.get(field) or '').strip()
+    if not text:
+        return default
     try:
-        if var is None or var == 'SAME':
-            new_order_dupl = duplicates_inds
-        else:
-            # Change order in the original df
-            new_order_dupl = [int(s) for s in var.split(',')]  # .strip('[]')
-            print(new_order_dupl)
-
+        value = cast(text)
+        # value != value catches NaN
+        valid = value == value and abs(value) != float('inf') and minimum <= value and \
+            (maximum is None or value <= maximum)
     except ValueError:
-        msg = f'Oops, looks like there are some formatting errors in what you typed ({var}). '
-        raise ValueError(msg)
-
-    # Note that any request pairs where one/two parties have no availability or no common availability are deleted
-    # This is b/c reindexing deletes any indices not mentioned
-    new_order = singles_inds + new_order_dupl
-    # print('The new order is:')
-    # print(new_order)
-    print('The old group is:')
-    print(group)
-    group = group.reindex(new_order)
-    print('The new group is:')
-    print(group)
-
-    # in order of matrix, schedule meetings.
-    for ind, row in group.iterrows():
-        # print(ind)
-        entity1 = row['entity1']  # all companies are entity1; inv are entity2
-        entity2 = row['entity2']
+        valid = False
+    if not valid:
+        kind = 'a whole number' if cast is int else 'a number'
+        bounds = f'from {minimum} to {maximum}' if maximum is not None else f'of at least {minimum}'
+        raise ValueError(f'Oops, the {label} should be {kind} {bounds}, not \'{text}\'. Please fix it and try again.')
+    return value
+
+
+def save_results(folder, job_id, engine, df_requests_combined_sorted=None):
+    # leave out the request list when it hasn't changed (late changes that moved no requests)
+    engine.to_schedule().to_csv(job_path(folder, job_id, 'df_schedule.csv'))
+    if df_requests_combined_sorted is not None:
+        df_requests_combined_sorted.to_csv(job_path(folder, job_id, 'df_requests_combined_sorted.csv'))
+
+
+def run_fill_job(folder, job_id, state, order=None, profile=False, cache=None):
+    # Runs in the job process pool; what it records in metrics goes back with the payload for the web process
+    before = metrics.registry.snapshot()
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with metrics.span('fill_job'):
+            state, payload = cached_fill_job(folder, job_id, state, order, cache)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(job_path(folder, job_id, 'profile-' + str(int(time.time() * 1000)) + '.pstats'))
+
+    payload['metrics'] = metrics.registry.diff(before)
+    return state, payload
+
+
+def cached_fill_job(folder, job_id, state, order=None, cache=None):
+    # a step is keyed on everything that led up to it plus this tie-break order
+    if cache is None or not state.get('cache_key'):
+        return fill_job(folder, job_id, state, order)
+
+    key = content_key(state['cache_key'], order)
+    hit = cache.get(key)
+    if hit is not None:
+        metrics.inc('cache_hits')
+        state, payload = hit
+        if state['cursor'].done:
+            save_results(folder, job_id, state['engine'], state['df_requests_combined_sorted'])
+        return state, payload
+
+    metrics.inc('cache_misses')
+    state, payload = fill_job(folder, job_id, state, order)
+    state['cache_key'] = key
+    cache.put(key, (state, payload))
+    return state, payload
+
+
+def fill_job(folder, job_id, state, order=None):
+    # apply the organizer's tie-break order (if any), then fill until the next tie
+    engine = state['engine']
+    df_requests_combined_sorted = state['df_requests_combined_sorted']
+    request_index = state['request_index']
+    cursor = state['cursor']
+    progress = ProgressReporter(folder, job_id)
+    # skipped unavailability rows are reported with the first result after the upload
+    msg = state.pop('notice', None)
+    ties_to_break = None
+    ties_to_break_indices = None
+    report = None
+    check = make_check(entity_types(engine, state['entity_index'])) if app.config['CHECK_FILL'] else None
+
+    if state.get('solver') in ('optimal', 'fair'):
+        if state['solver'] == 'optimal':
+            with metrics.span('solve_exact'):
+                engine, df_requests_combined_sorted, report = run_optimal_fill(
+                    engine, df_requests_combined_sorted, request_index, cursor, state.get('time_budget', 10.0))
+        else:
+            with metrics.span('fill_fair'):
+                engine, df_requests_combined_sorted, report = run_fair_fill(
+                    engine, df_requests_combined_sorted, request_index, cursor, state.get('min_meetings', 0),
+                    state.get('max_meetings'), state.get('fairness', 1.0))
+        if check is not None:
+            check(engine, cursor.position)
+        state['engine'] = engine
+        state['df_requests_combined_sorted'] = df_requests_combined_sorted
+        save_results(folder, job_id, engine, df_requests_combined_sorted)
+        return state, {'msg': msg, 'ties_to_break': None, 'ties_to_break_indices': None, 'report': report,
+                       'done': cursor.position, 'total': cursor.num_groups}
+
+    if order is not None:
         try:
-            entity1_row = df_schedule.index[df['entity'] == entity1].tolist()[0]
-            entity2_row = df_schedule.index[df['entity'] == entity2].tolist()[0]
-        except IndexError as err:
-            msg = f'Oops, looks like one or more of the numbers in {var} might be wrong. '
-            raise ValueError(str(err) + '\n' + msg)
-
-        entity1_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity1_row] == '') if x]
-        entity2_open_cols = [i for i, x in enumerate(df_schedule.iloc[entity2_row] == '') if x]
+            fill_schedule(engine, df_requests_combined_sorted, request_index, order, cursor, check=check)
+        except ValueError as err:
+            msg = 'Something went wrong. ' + \
+                  '\nError: ' + str(err) + \
+                  '\n\n Please check your submission, fix it, and resubmit it.'
 
-        try:
-            # open_col = set(entity1_open_cols).intersection(entity2_open_cols).pop()
-            # print(df_schedule.iloc[entity1_row])
-            # print(df_schedule.iloc[entity2_row])
-            open_col = min(set(entity1_open_cols).intersection(entity2_open_cols))
+    try:
+        tie_policy = get_tie_policy(state.get('tie_policy'), state.get('tie_seed', 0))
+        ties_to_break, ties_to_break_indices = fill_until_tie(
+            engine, df_requests_combined_sorted, request_index, cursor, progress, tie_policy, check)
+    except ValueError as err:
+        msg = 'Something went wrong internally. ' + \
+              '\nError: ' + str(err) + \
+              '\n\n Please check your submission and try again or contact Minna.'
 
-        except AttributeError:
-            continue
+    if cursor.done:
+        if state.get('local_search_time'):
+            logger.info('Improving the schedule')
+            with metrics.span('local_search'):
+                report = improve_schedule(engine, df_requests_combined_sorted, request_index,
+                                          state['local_search_time'], state.get('fixed'))
+            if check is not None:
+                check(engine, cursor.position)
+        save_results(folder, job_id, engine, df_requests_combined_sorted)
 
-        except ValueError:
-            continue
+    return state, {'msg': msg, 'ties_to_break': ties_to_break, 'ties_to_break_indices': ties_to_break_indices,
+                   'report': report, 'done': cursor.position, 'total': cursor.num_groups}
 
-        df_schedule.iloc[entity1_row, open_col] = entity2
-        df_schedule.iloc[entity2_row, open_col] = entity1
-        df_requests_combined_sorted.loc[ind, 'scheduled'] = True
 
-        # Mark if the entity requested that meeting; NOTE: includes backups
-        entity1_requests = df_requests[df_requests['entity'] == entity1].values
-        df_schedule.iloc[entity1_row, open_col + 1] = entity2 in entity1_requests
-        entity2_requests = df_requests[df_requests['entity'] == entity2].values
-        df_schedule.iloc[entity2_row, open_col + 1] = entity1 in entity2_requests
+# asset_url('bundle.css') in a template -> the current fingerprinted file; static/dist/ is built on first use if
+# there's no manifest yet (python build_assets.py rebuilds it, and the manifest is read again once its mtime changes)
+_asset_manifest = (None, None)
 
-    return df_schedule, df_requests_combined_sorted
 
+def asset_url(name):
+    global _asset_manifest
+    path = os.path.join(build_assets.DIST, 'manifest.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        build_assets.build()
+        mtime = os.stat(path).st_mtime_ns
+    if _asset_manifest[0] != mtime:
+        with open(path) as f:
+            _asset_manifest = (mtime, json.load(f))
+    return url_for('asset', filename=_asset_manifest[1][name])
+
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    # a fingerprinted file never changes under its name, so browsers can keep it for good; send the precompressed
+    # copy when the browser takes it
+    response = None
+    for encoding in ('br', 'gzip'):
+        compressed = filename + ('.br' if encoding == 'br' else '.gz')
+        if encoding in request.accept_encodings and os.path.exists(os.path.join(build_assets.DIST, compressed)):
+            response = send_from_directory(build_assets.DIST, compressed, mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(build_assets.DIST, filename)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
-def check_column_names(df):
-    if not ('entity' in df.columns):
-        msg = 'There is no column labeled \'entity\'. Please fix your spreadsheet and try again.'
-        raise ValueError(msg)
-        # sys.exit()
 
-    if not ('type' in df.columns):
-        msg = 'There is no column labeled \'type\'. Please fix your spreadsheet and try again.'
-        raise ValueError(msg)
+@app.route("/")
+def index():
+    return render_template("upload.html")
 
-    if not ('importance' in df.columns):
-        msg = 'There is no column labeled \'importance\'. Please fix your spreadsheet and try again.'
-        raise ValueError(msg)
 
-    if sum([1 for col in df.columns if 'choice' in col]) == 0:
-        msg = 'There are no meeting request columns (should be in the format \'choice_#\'). ' \
-              'Please fix your spreadsheet and try again.'
-        raise ValueError(msg)
+# the only files in a job's folder meant for the organizer; state.pkl, status.json etc. stay on the server
+DOWNLOADS = ('df_schedule.csv', 'df_requests_combined_sorted.csv')
 
 
-@app.route("/")
-def index():
-    return render_template("upload.html")
+def require_own_job(job_id):
+    # a job's files and pages are only for the session that uploaded it; anyone else gets a 404
+    if job_id != session.get('job_id'):
+        abort(404)
 
 
-@app.route('/uploads/<path:filename>', methods=['GET', 'POST'])
-def download(filename):
-    uploads = os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER'])
-    return send_from_directory(directory=uploads, filename=filename)
+@app.route('/uploads/<job_id>/<filename>', methods=['GET', 'POST'])
+def download(job_id, filename):
+    require_own_job(job_id)
+    if filename not in DOWNLOADS:
+        abort(404)
+    try:
+        folder = job_dir(app.config['UPLOAD_FOLDER'], job_id)
+    except ValueError:
+        abort(404)
+    # files are written relative to the working directory, so serve them from there too
+    return send_from_directory(os.path.abspath(folder), filename)
+
+
+def start_fill_job(job_id, state, order=None):
+    def on_done(result):
+        new_state, payload = result
+        state_store.save(job_id, new_state)
+        # inline jobs already recorded into this process's registry
+        delta = payload.pop('metrics')
+        if app.config['BACKGROUND_JOBS']:
+            metrics.registry.merge(delta)
+        return payload
+
+    args = (app.config['UPLOAD_FOLDER'], job_id, state, order, app.config['PROFILE_JOBS'], result_cache)
+    if app.config['BACKGROUND_JOBS']:
+        mark_queued(app.config['UPLOAD_FOLDER'], job_id)
+
+        # the routes call this holding the job's lock, and the job's done callback takes it too
+        @after_this_request
+        def launch(response):
+            submit(app.config['UPLOAD_FOLDER'], job_id, run_fill_job, args, on_done, app.config['JOB_WORKERS'])
+            return response
+        return render_template("progress.html", job_id=job_id)
+
+    run_inline(app.config['UPLOAD_FOLDER'], job_id, run_fill_job, args, on_done)
+    return redirect(url_for('job_result', job_id=job_id))
+
+
+def ingest_upload(filepath):
+    # the spreadsheet -> its blank schedule, and the scheduling state the next pages pick up
+    logger.info('Reading file')
+    with metrics.span('read'):
+        # checks the column names on the first chunk
+        df = read_event(filepath)
+
+    logger.info('Taking in data')
+    with metrics.span('ingest'):
+        df_request_pairs, df_requests, num_meetings, request_index = get_requests_from_data(df, BACKUP_WEIGHT)
+    with metrics.span('clean_up'):
+        df_requests_combined_sorted = clean_up_requests(df_request_pairs, build_entity_index(df).index)
+    metrics.inc('requests', len(df_requests_combined_sorted))
+
+    logger.info('Setting up schedule')
+    with metrics.span('create_schedule'):
+        df_schedule = create_schedule(df, num_meetings)
+
+    return df_schedule, {
+        'entity_index': build_entity_index(df),
+        'df_requests_combined_sorted': df_requests_combined_sorted,
+        'request_index': request_index,
+        'cursor': TieCursor.from_sorted_requests(df_requests_combined_sorted),
+        'backup_weight': BACKUP_WEIGHT,
+    }
 
 
 @app.route("/upload", methods=['POST'])
 def upload():
-    global original_filename
     msg = None
+    schedule_link = None
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
+    collect_stale_jobs(app.config['UPLOAD_FOLDER'], app.config['WORKSPACE_TTL'])
 
     if request.method == "POST":
+        job_id = create_job(app.config['UPLOAD_FOLDER'])
         file = request.files['file']
-        # print(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+        filepath = job_path(app.config['UPLOAD_FOLDER'], job_id, 'original.csv')
         file.save(filepath)
-        # print(filepath)
-        original_filename = filepath
 
         try:
-            print('STATUS: Reading file')
-            df = pd.read_csv(filepath)
-
-            print('STATUS: Checking column names\n')
-            check_column_names(df)
-
-            print('STATUS: Taking in data\n')
-            df_request_pairs, df_requests, num_meetings = get_requests_from_data(df)
-            df_requests_combined_sorted = clean_up_requests(df_request_pairs)
-
-            print('STATUS: Setting up schedule\n')
-            df_schedule = create_schedule(df, num_meetings)
+            with open(filepath, 'rb') as f:
+                upload_key = content_key(f.read())
+            cached = result_cache.get(upload_key) if result_cache is not None else None
+            if cached is not None:
+                metrics.inc('cache_hits')
+                df_schedule, state = cached
+            else:
+                df_schedule, state = ingest_upload(filepath)
+                if result_cache is not None:
+                    metrics.inc('cache_misses')
+                    result_cache.put(upload_key, (df_schedule, state))
 
         except Exception as err:
             msg = 'Something went wrong. ' + \
@@ -464,171 +345,280 @@ def upload():
                   # '\n\n Please check your spreadsheet and try again or contact Minna.'
 
         else:
-            df.to_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df') + '.csv')
-            df_requests.to_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests') + '.csv')
-            df_schedule.to_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv')
-            df_requests_combined_sorted.to_csv(os.path.join(
-                app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv')
+            # the blank schedule goes to the organizer as a CSV; everything else stays in the state store
+            df_schedule.to_csv(job_path(app.config['UPLOAD_FOLDER'], job_id, 'df_schedule.csv'))
+            schedule_link = url_for('download', job_id=job_id, filename='df_schedule.csv')
+            state['upload_key'] = upload_key
+            state_store.save(job_id, state)
+            session['job_id'] = job_id
 
-    schedule_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-    # schedule_link = os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-
-    return render_template("schedule_unavailability.html", msg=msg, schedule_link=schedule_link)
+    return render_template("schedule_unavailability.html", msg=msg, schedule_link=schedule_link,
+                           tie_policies=TIE_POLICIES)
 
 
 @app.route("/schedule_unavailability", methods=['POST'])
 def schedule_unavailability():
-    ties_to_break = None
-    msg = None
-    filepath = None
-    ties_to_break_indices = None
-    tie_break = 0
+    job_id = session.get('job_id')
 
-    if request.method == "POST":
+    try:
+        # organizers re-upload the blank schedule with N/A (or UNAVAILABLE) in the slots people can't make
+        schedule_bytes = request.files['file'].read()
+        df_schedule = pd.read_csv(io.BytesIO(schedule_bytes), index_col=0)
+        df_schedule = df_schedule.replace(np.nan, '', regex=True)
+        engine = SlotEngine.from_schedule(df_schedule)
+
+        # and/or list them all in one (entity, meeting) file
+        notice = None
+        unavailability_bytes = b''
+        unavailability_file = request.files.get('unavailability')
+        if unavailability_file is not None and unavailability_file.filename:
+            unavailability_bytes = unavailability_file.read()
+            df_unavailable = read_unavailability(io.BytesIO(unavailability_bytes))
+            notice = describe_report(apply_unavailability(engine, df_unavailable))
+
+    except Exception as err:
+        msg = 'Something went wrong. ' + '\nError: ' + str(
+            err) + '\n\n Please check your spreadsheet and try again or contact Minna.'
+
+        return render_template("break_ties.html", msg=msg)
+
+    try:
+        with locked(app.config['UPLOAD_FOLDER'], job_id):
+            state = state_store.load(job_id)
+            if state is None:
+                raise ValueError('Your session has expired. Please upload your spreadsheet again.')
+            if is_active(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT']):
+                return render_template("progress.html", job_id=job_id)
+
+            # meetings typed into the schedule have to add up before anything is filled around them
+            problems = describe_problems(check_schedule(engine, entity_types(engine, state['entity_index'])))
+            if problems is not None:
+                msg = 'Something went wrong. ' + '\nError: ' + problems + \
+                      '\n\n Please check your spreadsheet and try again or contact Minna.'
+                return render_template("break_ties.html", msg=msg)
+
+            state['df_requests_combined_sorted'] = state['df_requests_combined_sorted'].assign(scheduled=False)
+            engine.mark_requests(state['request_index'])
+            state['engine'] = engine
+            state['cursor'].position = 0
+            state['tie_policy'] = request.form.get('tie_policy', 'interactive')
+            state['tie_seed'] = form_number(request.form, 'tie_seed', 'random seed', int, 0, maximum=2 ** 32 - 1)
+            get_tie_policy(state['tie_policy'], state['tie_seed'])
+            state['solver'] = request.form.get('solver', 'greedy')
+            if state['solver'] not in ('greedy', 'optimal', 'fair'):
+                raise ValueError(f'Unknown solver \'{state["solver"]}\' '
+                                 f'(expected \'greedy\', \'optimal\' or \'fair\').')
+            state['time_budget'] = form_number(request.form, 'time_budget', 'time limit for the best-score search',
+                                               default=10.0)
+            state['min_meetings'] = form_number(request.form, 'min_meetings', 'minimum number of meetings', int, 0)
+            state['max_meetings'] = form_number(request.form, 'max_meetings', 'maximum number of meetings', int,
+                                                minimum=1)
+            state['fairness'] = form_number(request.form, 'fairness', 'fairness weight', default=1.0)
+            check_limits(state['min_meetings'], state['max_meetings'], state['fairness'])
+            state['local_search_time'] = form_number(request.form, 'local_search_time',
+                                                     'time for moving meetings around', default=0.0)
+            # meetings typed into the uploaded schedule stay put when the schedule is improved afterwards
+            state['fixed'] = engine.assigned >= 0
+            state['notice'] = notice
+            # the first fill job's cache key; each tie-break answer extends it
+            state['cache_key'] = content_key(state.get('upload_key'), schedule_bytes, unavailability_bytes, [
+                state['tie_policy'], state['tie_seed'], state['solver'], state['time_budget'],
+                state['local_search_time'], state['min_meetings'], state['max_meetings'],
+                state['fairness']]) if state.get('upload_key') else None
+
+            logger.info('Scheduling (with tie breaks), %s score groups', state['cursor'].num_groups)
+            return start_fill_job(job_id, state)
 
-        # entity_list = request.form["entities"].split("\n")
-        # conflict_strs_list = request.form["conflict_strs"].split("\n")
-        # print(entity_list)
+    except ValueError as err:
+        return render_template("upload.html", msg=str(err))
 
-        try:
 
-            file = request.files['file']
-            filename = file.filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            os.remove(filepath)
-            file.save(filepath)
+@app.route("/break_ties", methods=['POST'])
+def break_ties():
+    job_id = session.get('job_id')
 
-        except Exception as err:
-            msg = 'Something went wrong. ' + '\nError: ' + str(
-                err) + '\n\n Please check your spreadsheet and try again or contact Minna.'
+    try:
+        with locked(app.config['UPLOAD_FOLDER'], job_id):
+            state = state_store.load(job_id)
+            if state is None or 'engine' not in state:
+                raise ValueError('Your session has expired. Please upload your spreadsheet again.')
+            if is_active(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT']):
+                return render_template("progress.html", job_id=job_id)
 
-            return render_template("break_ties.html", msg=msg)
+            # one order box per independent cluster of tied meetings
+            return start_fill_job(job_id, state, request.form.getlist("order"))
 
-    df_schedule = pd.read_csv(filepath, index_col=0)
-    df_schedule = df_schedule.replace(np.nan, '', regex=True)
+    except ValueError as err:
+        return render_template("upload.html", msg=str(err))
 
-    df_requests_combined_sorted = pd.read_csv(os.path.join(
-        app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv', index_col=0)
-    df_requests = pd.read_csv(
-        os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests') + '.csv')
-    df = pd.read_csv(
-        os.path.join(app.config['UPLOAD_FOLDER'], 'df') + '.csv')
-    # print(df_schedule)
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    require_own_job(job_id)
     try:
-        print('STATUS: Scheduling (with tie breaks)\n')
-        ties_to_break, ties_to_break_indices, tie_break = offer_reorder(df_schedule, df_requests_combined_sorted, df, tie_break)
-        print('max_tie_break = ' + str(max_tie_break))
-        print('tie_break = ' + str(tie_break))
-
-        while ties_to_break is None:
-            df_schedule, df_requests_combined_sorted = fill_schedule(
-                df_schedule, df_requests_combined_sorted, df_requests, df, ties_to_break, tie_break)
-            ties_to_break, ties_to_break_indices, tie_break = offer_reorder(df_schedule, df_requests_combined_sorted, df, tie_break)
-            print('tie_break = ' + str(tie_break))
-            print(df_schedule)
-
-            if tie_break == max_tie_break:
-                schedule_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-                requests_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv'
-
-                return render_template("download_schedule.html",
-                                       schedule_link=schedule_link, requests_link=requests_link)
-    except ValueError as err:
-        msg = 'Something went wrong. ' + \
-              '\nError: ' + str(err) + \
-              '\n\n Please check your submission and try again or contact Minna.'
+        status = read_status(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT'])
+    except ValueError:
+        status = None
+    if status is None:
+        return jsonify({'status': 'unknown'}), 404
 
-    df_schedule.to_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv')
-    df_requests_combined_sorted.to_csv(os.path.join(
-        app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv')
+    status['result_url'] = url_for('job_result', job_id=job_id)
+    return jsonify(status)
 
-    if tie_break == max_tie_break:
-        schedule_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-        requests_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv'
 
-        return render_template("download_schedule.html", schedule_link=schedule_link, requests_link=requests_link)
-    else:
-        progress = str(tie_break) + ' out of ' + str(max_tie_break)
-        session['tie_break'] = tie_break
-        return render_template("break_ties.html", msg=msg, ties_to_break=ties_to_break, progress=progress,
-                               ties_to_break_indices=ties_to_break_indices)
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    # server-sent events version of job_status: one message per status change until the job finishes
+    require_own_job(job_id)
+
+    def events():
+        last_update = None
+        while True:
+            try:
+                status = read_status(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT']) or \
+                    {'status': 'unknown'}
+            except ValueError:
+                status = {'status': 'unknown'}
+            # a job found stale turns failed without a new update time
+            if (status.get('updated'), status['status']) != last_update:
+                last_update = (status.get('updated'), status['status'])
+                yield 'data: ' + json.dumps(status) + '\n\n'
+            if status['status'] not in ACTIVE:
+                return
+            time.sleep(0.5)
 
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
 
-@app.route("/break_ties", methods=['POST'])
-def break_ties():
-    tie_break = session.get('tie_break')
-    ties_to_break = None
-    msg = None
-    ties_to_break_indices = None
 
-    df_schedule = pd.read_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv', index_col=0)
-    df_schedule = df_schedule.replace(np.nan, '', regex=True)
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    require_own_job(job_id)
+    try:
+        status = read_status(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT'])
+    except ValueError:
+        status = None
+    if status is None:
+        return render_template("upload.html", msg='Your session has expired. Please upload your spreadsheet again.')
+    if status['status'] in ACTIVE:
+        return render_template("progress.html", job_id=job_id)
+    if status['status'] == 'failed':
+        msg = 'Something went wrong internally. ' + \
+              '\nError: ' + status['error'] + \
+              '\n\n Please check your submission and try again or contact Minna.'
+        return render_template("break_ties.html", msg=msg)
 
-    df_requests_combined_sorted = pd.read_csv(
-        os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv', index_col=0)
-    df_requests = pd.read_csv(
-        os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests') + '.csv')
-    df = pd.read_csv(
-        os.path.join(app.config['UPLOAD_FOLDER'], 'df') + '.csv')
+    if status['done'] >= status['total']:
+        schedule_link = url_for('download', job_id=job_id, filename='df_schedule.csv')
+        requests_link = url_for('download', job_id=job_id, filename='df_requests_combined_sorted.csv')
 
-    if request.method == "POST":
-        broken_tie_indices = request.form["order"]
+        # a job that ran straight to the end still carries the unavailability notice
+        return render_template("download_schedule.html", msg=status.get('msg'), schedule_link=schedule_link,
+                               requests_link=requests_link,
+                               itineraries_link=url_for('export_itineraries', job_id=job_id),
+                               report=status.get('report'))
+    else:
+        progress = str(status['done'] + 1) + ' out of ' + str(status['total'])
+        tie_components = list(zip(status['ties_to_break'] or [], status['ties_to_break_indices'] or []))
+        return render_template("break_ties.html", msg=status['msg'], tie_components=tie_components,
+                               progress=progress)
 
-        try:
-            df_schedule, df_requests_combined_sorted = fill_schedule(df_schedule, df_requests_combined_sorted,
-                                                                     df_requests, df, broken_tie_indices, tie_break)
-            ties_to_break, ties_to_break_indices, tie_break = offer_reorder(df_schedule, df_requests_combined_sorted, df, tie_break)
-            print('tie_break = ' + str(tie_break))
-            print(df_schedule)
-        except ValueError as err:
-            msg = 'Something went wrong. ' + \
-                  '\nError: ' + str(err) + \
-                  '\n\n Please press the back button, check your submission, fix it, and resubmit it.'
 
-        try:
-            while ties_to_break is None:
-                df_schedule, df_requests_combined_sorted = fill_schedule(df_schedule, df_requests_combined_sorted,
-                                                                         df_requests, df, ties_to_break, tie_break)
-                ties_to_break, ties_to_break_indices, tie_break = offer_reorder(df_schedule, df_requests_combined_sorted, df, tie_break)
-                print('tie_break = ' + str(tie_break))
+@app.route("/jobs/<job_id>/itineraries.zip")
+def export_itineraries(job_id):
+    # the finished schedule split into one itinerary per entity, streamed as a ZIP while it's being written
+    require_own_job(job_id)
+    try:
+        status = read_status(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT'])
+        if status is None or status['status'] != 'done' or status['done'] < status['total']:
+            raise ValueError('Your session has expired. Please upload your spreadsheet again.')
+        first_start = parse_start(request.args.get('date') or time.strftime('%Y-%m-%d'),
+                                  request.args.get('start') or '09:00')
+        minutes = form_number(request.args, 'minutes', 'meeting length in minutes', int, 30, minimum=1)
+        formats = parse_formats(request.args.getlist('format') or ['csv', 'xlsx', 'ics'])
+        # only for telling backups from main choices; the itineraries themselves come from the schedule CSV
+        state = state_store.load(job_id)
+        request_index = state.get('request_index') if state is not None else None
+        pieces = stream_itineraries(job_path(app.config['UPLOAD_FOLDER'], job_id, 'df_schedule.csv'), first_start,
+                                    minutes, formats, request_index)
+        first_piece = next(pieces)  # argument errors surface here, before the response starts
+    except ValueError as err:
+        return render_template("upload.html", msg=str(err))
 
-                if tie_break == max_tie_break:
-                    schedule_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-                    requests_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv'
+    def chunks():
+        yield first_piece
+        yield from pieces
 
-                    return render_template("download_schedule.html", schedule_link=schedule_link,
-                                           requests_link=requests_link)
+    metrics.inc('itinerary_exports')
+    return Response(stream_with_context(chunks()), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=itineraries.zip'})
 
-            df_schedule.to_csv(os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv')
-            df_requests_combined_sorted.to_csv(
-                os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv')
 
-        except ValueError as err:
-            msg = 'Something went wrong internally. ' + \
-                  '\nError: ' + str(err) + \
-                  '\n\n Please check your submission and try again or contact Minna.'
+@app.route("/reschedule", methods=['POST'])
+def reschedule():
+    job_id = session.get('job_id')
 
-    if tie_break == max_tie_break:
-        schedule_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv'
-        requests_link = os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv'
+    try:
+        unavailability_file = request.files.get('unavailability')
+        df_unavailable = None
+        if unavailability_file is not None and unavailability_file.filename:
+            df_unavailable = read_unavailability(unavailability_file)
+        added_file = request.files.get('added_requests')
+        df_added = None
+        if added_file is not None and added_file.filename:
+            df_added = read_added_requests(added_file)
+        withdrawn = [line.strip() for line in request.form.get('withdrawn', '').splitlines() if line.strip()]
+
+        with locked(app.config['UPLOAD_FOLDER'], job_id):
+            state = state_store.load(job_id)
+            if state is None or 'engine' not in state or 'entity_index' not in state:
+                raise ValueError('Your session has expired. Please upload your spreadsheet again.')
+            if is_active(app.config['UPLOAD_FOLDER'], job_id, app.config['JOB_TIMEOUT']):
+                return render_template("progress.html", job_id=job_id)
+            if not state['cursor'].done:
+                raise ValueError('Finish the schedule before making changes to it.')
+
+            logger.info('Rescheduling around late changes')
+            with metrics.span('reschedule'):
+                report = apply_late_changes(state, df_unavailable, withdrawn, df_added)
+            if app.config['CHECK_FILL']:
+                problems = describe_problems(check_schedule(state['engine'],
+                                                            entity_types(state['engine'], state['entity_index'])))
+                if problems is not None:
+                    raise ValueError(problems)
+            # the changed schedule isn't a replay of anything any more
+            state['cache_key'] = None
+            requests_changed = report['evicted'] or report['placed'] or report['rescored']
+            save_results(app.config['UPLOAD_FOLDER'], job_id, state['engine'],
+                         state['df_requests_combined_sorted'] if requests_changed else None)
+            state_store.save(job_id, state)
 
-        return render_template("download_schedule.html", schedule_link=schedule_link, requests_link=requests_link)
-    else:
-        progress = str(tie_break) + ' out of ' + str(max_tie_break)
-        session['tie_break'] = tie_break
-        return render_template("break_ties.html", msg=msg, ties_to_break=ties_to_break, progress=progress,
-                               ties_to_break_indices=ties_to_break_indices)
+    except ValueError as err:
+        return render_template("upload.html", msg=str(err))
+
+    msg = str(report['evicted']) + ' meetings were moved out by the changes; ' + str(report['placed']) + \
+        ' out of ' + str(report['retried']) + ' affected requests have been scheduled again.'
+    if report['unknown_entities']:
+        msg += ' Unknown names (skipped): ' + ', '.join(report['unknown_entities']) + '.'
+    if report['bad_meetings']:
+        msg += ' Meetings that don\'t exist (skipped): ' + ', '.join(report['bad_meetings']) + '.'
+    if report['skipped_requests']:
+        msg += ' Requests that were skipped (unknown names or same type): ' + \
+               ', '.join(entity + ' -> ' + other for entity, other in report['skipped_requests']) + '.'
+
+    schedule_link = url_for('download', job_id=job_id, filename='df_schedule.csv')
+    requests_link = url_for('download', job_id=job_id, filename='df_requests_combined_sorted.csv')
+    return render_template("download_schedule.html", msg=msg, schedule_link=schedule_link, requests_link=requests_link,
+                           itineraries_link=url_for('export_itineraries', job_id=job_id))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route("/download_schedule", methods=['POST'])
 def download_schedule():
-    # delete the folder
-    # os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'df_schedule') + '.csv')
-    # os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'df') + '.csv')
-    # os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests_combined_sorted') + '.csv')
-    # os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'df_requests') + '.csv')
-    # os.remove(original_filename)
+    # the job's folder is deleted by collect_stale_jobs() once it's older than WORKSPACE_TTL
 
     return render_template("completed.html")
 
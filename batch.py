@@ -0,0 +1,222 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from local_search import improve_schedule
+from pipeline import build_entity_index, check_column_names, clean_up_requests, create_schedule, fill_schedule, \
+    fill_until_tie, get_requests_from_data, read_event, run_fair_fill, run_optimal_fill
+from schedule_check import check_schedule, describe_problems, entity_types
+from slot_engine import SlotEngine
+from tie_cursor import TieCursor
+from tie_policies import TIE_POLICIES, get_tie_policy
+from unavailability import apply_unavailability, describe_report, read_unavailability
+
+# Headless version of the upload -> unavailability -> fill -> download flow, for one event or a whole folder:
+#   python batch.py events/ --output schedules/ --tie-policy mutual_first --jobs 4
+# Next to each event.csv the batch picks up event.schedule.csv (the blank schedule with N/A typed in, like the
+# unavailability page takes), event.unavailable.csv (bulk (entity, meeting) rows) and event.ties.json (tie-break
+# orders recorded from the break_ties page: a list with one entry per tie prompt, each either one order string or
+# one string per cluster). Ties left over once the recorded orders run out go to the tie policy.
+
+SIDECARS = ('.schedule.csv', '.unavailable.csv', '.ties.json')
+
+logger = logging.getLogger('mezzo_match')
+
+
+def _read(table, **kwargs):
+    return table if isinstance(table, pd.DataFrame) or table is None else pd.read_csv(table, **kwargs)
+
+
+def schedule_event(event, schedule=None, unavailability=None, tie_policy='same', tie_seed=0, tie_orders=None,
+                   solver='greedy', time_budget=10.0, local_search_time=0.0, min_meetings=0, max_meetings=None,
+                   fairness=1.0):
+    """Schedule one event; every table may be given as a DataFrame or a CSV path.
+
+    Returns (schedule, request list, summary): the same two tables the download page links to, and a dict with
+    the counts and reports the web pages show.
+    """
+    if isinstance(event, pd.DataFrame):
+        df = event
+        check_column_names(df)
+    else:
+        df = read_event(event)
+    df_request_pairs, df_requests, num_meetings, request_index = get_requests_from_data(df)
+    entity_index = build_entity_index(df)
+    df_requests_combined_sorted = clean_up_requests(df_request_pairs, entity_index.index)
+
+    if schedule is None:
+        df_schedule = create_schedule(df, num_meetings)
+    else:
+        df_schedule = _read(schedule, index_col=0)
+    engine = SlotEngine.from_schedule(df_schedule.replace(np.nan, ''))
+    types = entity_types(engine, entity_index)
+    problems = describe_problems(check_schedule(engine, types))
+    if problems is not None:
+        raise ValueError(problems)
+    notice = None
+    if unavailability is not None:
+        df_unavailable = unavailability if isinstance(unavailability, pd.DataFrame) \
+            else read_unavailability(unavailability)
+        notice = describe_report(apply_unavailability(engine, df_unavailable))
+    engine.mark_requests(request_index)
+    fixed = engine.assigned >= 0
+    df_requests_combined_sorted = df_requests_combined_sorted.assign(scheduled=False)
+    cursor = TieCursor.from_sorted_requests(df_requests_combined_sorted)
+
+    report = None
+    orders_used = 0
+    if solver == 'optimal':
+        engine, df_requests_combined_sorted, report = run_optimal_fill(
+            engine, df_requests_combined_sorted, request_index, cursor, time_budget)
+    elif solver == 'fair':
+        engine, df_requests_combined_sorted, report = run_fair_fill(
+            engine, df_requests_combined_sorted, request_index, cursor, min_meetings, max_meetings, fairness)
+    elif solver == 'greedy':
+        policy = get_tie_policy(tie_policy, tie_seed)
+        # replay the recorded answers first: each one is what the organizer typed at the next tie prompt
+        for order in tie_orders or []:
+            ties, _ = fill_until_tie(engine, df_requests_combined_sorted, request_index, cursor)
+            if ties is None:
+                break
+            fill_schedule(engine, df_requests_combined_sorted, request_index, order, cursor)
+            orders_used += 1
+        ties, _ = fill_until_tie(engine, df_requests_combined_sorted, request_index, cursor, tie_policy=policy)
+        if ties is not None:
+            raise ValueError('There are ties left to break. Pass a tie policy or more recorded orders.')
+        if local_search_time:
+            report = improve_schedule(engine, df_requests_combined_sorted, request_index, local_search_time, fixed)
+    else:
+        raise ValueError(f'Unknown solver \'{solver}\' (expected \'greedy\', \'optimal\' or \'fair\').')
+
+    # whatever filled it, the result has to add up too
+    problems = describe_problems(check_schedule(engine, types))
+    if problems is not None:
+        raise ValueError(problems)
+
+    scheduled = df_requests_combined_sorted['scheduled'].values
+    scores = df_requests_combined_sorted['score'].values
+    summary = {
+        'requests': int(len(scheduled)),
+        'scheduled': int(scheduled.sum()),
+        'score': float(scores[scheduled].sum()),
+        'total_score': float(scores.sum()),
+        'score_groups': int(cursor.num_groups),
+        'tie_orders_used': orders_used,
+        'notice': notice,
+        'report': report,
+    }
+    return engine.to_schedule(), df_requests_combined_sorted, summary
+
+
+def find_events(paths):
+    """Event CSVs among paths (files, or folders searched for *.csv), leaving out the sidecar files."""
+    events = []
+    for path in paths:
+        candidates = sorted(glob.glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path]
+        events += [c for c in candidates if not c.endswith(SIDECARS)]
+    return events
+
+
+def sidecar(event_path, suffix):
+    path = os.path.splitext(event_path)[0] + suffix
+    return path if os.path.exists(path) else None
+
+
+def run_event_file(event_path, output_dir, options):
+    """Schedule one event file with its sidecars and write the results to output_dir/<event name>/."""
+    start = time.perf_counter()
+    name = os.path.splitext(os.path.basename(event_path))[0]
+    summary = {'event': event_path}
+    try:
+        tie_orders = options.get('tie_orders')
+        ties_path = sidecar(event_path, '.ties.json')
+        if tie_orders is None and ties_path is not None:
+            with open(ties_path) as f:
+                tie_orders = json.load(f)
+
+        df_schedule, df_requests_combined_sorted, result = schedule_event(
+            event_path, sidecar(event_path, '.schedule.csv'), sidecar(event_path, '.unavailable.csv'),
+            options.get('tie_policy', 'same'), options.get('tie_seed', 0), tie_orders, options.get('solver', 'greedy'),
+            options.get('time_budget', 10.0), options.get('local_search_time', 0.0), options.get('min_meetings', 0),
+            options.get('max_meetings'), options.get('fairness', 1.0))
+    except Exception as err:
+        summary['error'] = str(err)
+    else:
+        folder = os.path.join(output_dir, name)
+        os.makedirs(folder, exist_ok=True)
+        df_schedule.to_csv(os.path.join(folder, 'df_schedule.csv'))
+        df_requests_combined_sorted.to_csv(os.path.join(folder, 'df_requests_combined_sorted.csv'))
+        summary.update(result, output=folder)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(paths, output_dir, options=None, workers=None):
+    """Schedule every event under paths, spread over worker processes; returns one summary per event."""
+    events = find_events(paths)
+    options = options or {}
+    if workers == 1 or len(events) <= 1:
+        return [run_event_file(event, output_dir, options) for event in events]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_event_file, event, output_dir, options) for event in events]
+        return [future.result() for future in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Schedule event CSVs without the web app.')
+    parser.add_argument('events', nargs='+', help='event CSVs, or folders of them')
+    parser.add_argument('--output', default='schedules', help='results go to OUTPUT/<event name>/')
+    parser.add_argument('--tie-policy', default='same', choices=sorted(TIE_POLICIES),
+                        help='how ties are broken once the recorded orders (if any) run out')
+    parser.add_argument('--tie-seed', type=int, default=0)
+    parser.add_argument('--tie-orders', help='recorded tie-break orders (JSON) for every event, instead of the '
+                                             'per-event .ties.json files')
+    parser.add_argument('--solver', default='greedy', choices=['greedy', 'optimal', 'fair'])
+    parser.add_argument('--time-budget', type=float, default=10.0, help='seconds for the optimal solver')
+    parser.add_argument('--local-search-time', type=float, default=0.0,
+                        help='seconds to improve each greedy schedule afterwards')
+    parser.add_argument('--min-meetings', type=int, default=0, help='fair solver: meetings every entity should get')
+    parser.add_argument('--max-meetings', type=int, default=None, help='fair solver: most meetings per entity')
+    parser.add_argument('--fairness', type=float, default=1.0,
+                        help='fair solver: how much each meeting held lowers the rest (0: plain score order)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(), format='%(levelname)s %(message)s')
+    options = {'tie_policy': args.tie_policy, 'tie_seed': args.tie_seed, 'solver': args.solver,
+               'time_budget': args.time_budget, 'local_search_time': args.local_search_time,
+               'min_meetings': args.min_meetings, 'max_meetings': args.max_meetings, 'fairness': args.fairness}
+    if args.tie_orders:
+        with open(args.tie_orders) as f:
+            options['tie_orders'] = json.load(f)
+
+    summaries = run_batch(args.events, args.output, options, args.jobs)
+    failed = 0
+    for summary in summaries:
+        if 'error' in summary:
+            failed += 1
+            print(f'{summary["event"]}: failed: {summary["error"]}', file=sys.stderr)
+        else:
+            print(f'{summary["event"]}: {summary["scheduled"]} of {summary["requests"]} requests scheduled, '
+                  f'score {summary["score"]:g} of {summary["total_score"]:g} ({summary["seconds"]:.2f}s)',
+                  file=sys.stderr)
+            if summary['notice']:
+                print('  ' + summary['notice'], file=sys.stderr)
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
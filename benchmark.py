@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from batch import schedule_event
+from pipeline import build_entity_index, clean_up_requests, create_schedule, fill_schedule, fill_until_tie, \
+    get_requests_from_data, offer_reorder
+from schedule_check import check_schedule, describe_problems, entity_types
+from slot_engine import SlotEngine
+from synthetic import generate_event, generate_unavailability
+from tie_cursor import TieCursor
+from tie_policies import get_tie_policy
+from unavailability import apply_unavailability
+
+# Times every stage of the scheduling pipeline on synthetic events and writes the results as JSON, e.g.
+#   python benchmark.py --sizes 100 1000 10000 --output bench.json
+# Stage timings are taken without tracemalloc; pass --trace-memory for per-stage peak allocations (which slows
+# every stage down, so compare timings only between runs with the same setting). The interactive loop is only timed.
+# --check also runs every solver on each event and exits 1 if one of them breaks its promise:
+#   python benchmark.py --sizes 100 1000 --check --output /dev/null
+
+
+class StageTimer(object):
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            result = {'seconds': time.perf_counter() - start}
+            if self.trace_memory:
+                result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stages[name] = result
+
+
+def run_pipeline(df_event, df_unavailable, tie_policy='same', trace_memory=False):
+    """Run upload -> unavailability -> fill on one event; returns (stage timings, schedule quality)."""
+    timer = StageTimer(trace_memory)
+    with timer.stage('get_requests_from_data'):
+        df_request_pairs, df_requests, num_meetings, request_index = get_requests_from_data(df_event)
+    with timer.stage('clean_up_requests'):
+        df_requests_combined_sorted = clean_up_requests(df_request_pairs, build_entity_index(df_event).index)
+    with timer.stage('create_schedule'):
+        df_schedule = create_schedule(df_event, num_meetings)
+    with timer.stage('load_schedule'):
+        engine = SlotEngine.from_schedule(df_schedule.replace(np.nan, ''))
+        apply_unavailability(engine, df_unavailable)
+        engine.mark_requests(request_index)
+    cursor = TieCursor.from_sorted_requests(df_requests_combined_sorted)
+    if tie_policy == 'interactive':
+        # the break_ties loop with an organizer who always answers SAME, timing both halves separately
+        offer_seconds = fill_seconds = 0.0
+        while not cursor.done:
+            start = time.perf_counter()
+            offer_reorder(engine, df_requests_combined_sorted, cursor)
+            offer_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            fill_schedule(engine, df_requests_combined_sorted, request_index, 'SAME', cursor)
+            fill_seconds += time.perf_counter() - start
+        timer.stages['offer_reorder'] = {'seconds': offer_seconds}
+        timer.stages['fill_schedule'] = {'seconds': fill_seconds}
+    else:
+        with timer.stage('fill_schedule'):
+            fill_until_tie(engine, df_requests_combined_sorted, request_index, cursor,
+                           tie_policy=get_tie_policy(tie_policy))
+
+    scheduled = df_requests_combined_sorted['scheduled'].values
+    scores = df_requests_combined_sorted['score'].values
+    quality = {
+        'requests': int(len(scheduled)),
+        'requests_met': int(scheduled.sum()),
+        'fraction_met': float(scheduled.mean()) if len(scheduled) else 0.0,
+        'total_score': float(scores[scheduled].sum()),
+        'score_fraction': float(scores[scheduled].sum() / scores.sum()) if scores.sum() else 0.0,
+        'score_groups': int(cursor.num_groups),
+        'meetings_per_entity': int(num_meetings),
+    }
+    return timer.stages, quality
+
+
+def check_solvers(df_event, df_unavailable, time_budget=10.0, local_search_time=2.0):
+    """Regression checks on one event; returns the failed ones as messages (an empty list when all pass).
+
+    Every solver has to leave a consistent schedule, the optimal solver and local search can't score below the
+    greedy fill, and the fair fill with fairness 0 has to reproduce the greedy schedule.
+    """
+    runs = {
+        'greedy': {'solver': 'greedy'},
+        'local search': {'solver': 'greedy', 'local_search_time': local_search_time},
+        'optimal': {'solver': 'optimal', 'time_budget': time_budget},
+        'fair': {'solver': 'fair'},
+        'fair with fairness 0': {'solver': 'fair', 'fairness': 0.0},
+    }
+    entity_index = build_entity_index(df_event)
+    failures = []
+    results = {}
+    for name, options in runs.items():
+        try:
+            results[name] = schedule_event(df_event, unavailability=df_unavailable, tie_policy='same', **options)
+        except ValueError as err:
+            # schedule_event checks the result itself too
+            failures.append(f'{name}: {err}')
+            continue
+        engine = SlotEngine.from_schedule(results[name][0].replace(np.nan, ''))
+        problems = describe_problems(check_schedule(engine, entity_types(engine, entity_index)))
+        if problems is not None:
+            failures.append(f'{name}: {problems}')
+
+    if 'greedy' in results:
+        greedy_schedule, greedy_requests, greedy = results['greedy']
+        for name in ('optimal', 'local search'):
+            if name in results and results[name][2]['score'] < greedy['score'] - 1e-9:
+                failures.append(f'{name} scored {results[name][2]["score"]:.1f}, below greedy\'s '
+                                f'{greedy["score"]:.1f}')
+        if 'fair with fairness 0' in results:
+            fair_schedule, fair_requests, _ = results['fair with fairness 0']
+            if not (fair_schedule.equals(greedy_schedule) and
+                    np.array_equal(fair_requests['scheduled'].values, greedy_requests['scheduled'].values)):
+                failures.append('fair with fairness 0 gave a different schedule than greedy')
+    return failures
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scheduling pipeline on synthetic events.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='total entities per event')
+    parser.add_argument('--investor-share', type=float, default=1 / 3.0)
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--backups', type=int, default=2)
+    parser.add_argument('--skew', type=float, default=1.0)
+    parser.add_argument('--density', type=float, default=0.05, help='share of unavailable slots')
+    parser.add_argument('--tie-policy', default='same', help='a tie policy name, or \'interactive\' to time the '
+                                                              'offer_reorder/fill_schedule loop answering SAME')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help='record per-stage peak allocations')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--check', action='store_true', help='also run the solver regression checks (exit 1 if '
+                                                             'one fails)')
+    parser.add_argument('--time-budget', type=float, default=10.0, help='seconds for the optimal solver in --check')
+    args = parser.parse_args(argv)
+    # the pipeline's status lines go through logging; LOG_LEVEL=INFO brings them back
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(), format='%(levelname)s %(message)s')
+
+    results = []
+    for size in args.sizes:
+        num_investors = max(1, int(round(size * args.investor_share)))
+        num_companies = max(1, size - num_investors)
+        df_event = generate_event(num_companies, num_investors, args.choices, args.backups, skew=args.skew,
+                                  seed=args.seed)
+        df_unavailable = generate_unavailability(df_event, args.choices, args.density, args.seed)
+
+        start = time.perf_counter()
+        stages, quality = run_pipeline(df_event, df_unavailable, args.tie_policy, args.trace_memory)
+        results.append({
+            'entities': size,
+            'companies': num_companies,
+            'investors': num_investors,
+            'seconds': time.perf_counter() - start,
+            'stages': stages,
+            'quality': quality,
+        })
+        print(f'{size} entities: {results[-1]["seconds"]:.2f}s, {quality["fraction_met"]:.1%} of requests met',
+              file=sys.stderr)
+        if args.check:
+            results[-1]['failed_checks'] = check_solvers(df_event, df_unavailable, args.time_budget)
+            for failure in results[-1]['failed_checks']:
+                print(f'{size} entities: FAILED {failure}', file=sys.stderr)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'timestamp': time.time(),
+        'parameters': vars(args),
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 1 if any(result.get('failed_checks') for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # .br files are optional; gzip covers every browser
+    brotli = None
+
+# Builds the pages' CSS/JS bundles into static/dist/: the stylesheets trimmed to the classes the templates (and
+# scripts.js) actually use, one fingerprinted file per bundle (bundle.<hash>.css) plus .gz/.br copies, and
+# manifest.json mapping bundle names to file names for asset_url() in the templates. The app runs this itself
+# when the manifest is missing; run it again (python build_assets.py) after changing the sources below.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC = os.path.join(ROOT, 'static')
+DIST = os.path.join(STATIC, 'dist')
+TEMPLATES = os.path.join(ROOT, 'templates')
+
+BUNDLES = {
+    'bundle.css': ['bootstrap.min.css', 'animate.min.css', 'icons.css'],
+    'bundle.js': ['scripts.js'],
+    'shot-3.png': ['shot-3.png'],
+}
+# purged: only rules for used classes survive
+PURGED = ('bootstrap.min.css', 'animate.min.css')
+
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+LICENSE = re.compile(r'/\*!.*?\*/', re.S)
+CLASS_ATTR = re.compile(r'class="([^"]*)"')
+JS_CLASS = re.compile(r'classList\.(?:add|remove|toggle)\([\'"]([\w-]+)[\'"]')
+SELECTOR_CLASS = re.compile(r'\.(-?[_a-zA-Z][_a-zA-Z0-9-]*)')
+WHITESPACE = re.compile(r'\s+')
+
+
+def used_classes():
+    """Class names in the templates (outside HTML comments) and the ones scripts.js adds or toggles."""
+    classes = set()
+    for path in glob.glob(os.path.join(TEMPLATES, '*.html')):
+        with open(path) as f:
+            html = re.sub(r'<!--.*?-->', '', f.read(), flags=re.S)
+        for attr in CLASS_ATTR.findall(html):
+            classes.update(attr.split())
+    with open(os.path.join(STATIC, 'scripts.js')) as f:
+        classes.update(JS_CLASS.findall(f.read()))
+    return classes
+
+
+def parse_rules(css):
+    """Top-level (prelude, body) pairs; body is None for statements like @charset/@import."""
+    rules = []
+    i = 0
+    while i < len(css):
+        brace = css.find('{', i)
+        semicolon = css.find(';', i)
+        if brace < 0:
+            break
+        if css[i:].lstrip().startswith('@') and 0 <= semicolon < brace:
+            rules.append((css[i:semicolon].strip(), None))
+            i = semicolon + 1
+            continue
+        depth = 0
+        for j in range(brace, len(css)):
+            if css[j] == '{':
+                depth += 1
+            elif css[j] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+        rules.append((css[i:brace].strip(), css[brace + 1:j]))
+        i = j + 1
+    return rules
+
+
+def split_selectors(prelude):
+    # commas inside :not(...) don't separate selectors
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(prelude):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(prelude[start:i].strip())
+            start = i + 1
+    parts.append(prelude[start:].strip())
+    return parts
+
+
+def purge(css, classes):
+    """Drop the rules (and selectors) that need a class nobody uses, then keyframes nothing animates with."""
+    kept = []
+    for prelude, body in parse_rules(css):
+        if body is None:
+            # no remote fonts (the pages must work offline), and @charset only counts at the top of a file
+            if not prelude.startswith(('@import', '@charset')):
+                kept.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = purge(body, classes)
+            if inner:
+                kept.append(prelude + '{' + inner + '}')
+        elif prelude.startswith('@'):
+            kept.append(prelude + '{' + WHITESPACE.sub(' ', body).strip() + '}')
+        else:
+            selectors = [s for s in split_selectors(prelude) if set(SELECTOR_CLASS.findall(s)) <= classes]
+            if selectors:
+                kept.append(','.join(selectors) + '{' + WHITESPACE.sub(' ', body).strip() + '}')
+
+    # keyframes survive if a kept rule still refers to them
+    text = '\n'.join(rule for rule in kept if not re.match(r'@(-webkit-)?keyframes', rule))
+    return '\n'.join(rule for rule in kept if not re.match(r'@(-webkit-)?keyframes', rule) or
+                     re.search(r'\b' + re.escape(rule.split()[1].split('{')[0]) + r'\b', text))
+
+
+def read_source(name, classes):
+    mode = 'rb' if name.endswith('.png') else 'r'
+    with open(os.path.join(STATIC, name), mode) as f:
+        content = f.read()
+    if name in PURGED:
+        # license headers (/*! ... */) stay, at the top
+        content = '\n'.join(LICENSE.findall(content) + [purge(COMMENT.sub('', content), classes)])
+    return content
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build():
+    """Write every bundle and the manifest; returns the manifest (bundle name -> fingerprinted file name)."""
+    os.makedirs(DIST, exist_ok=True)
+    manifest_path = os.path.join(DIST, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    classes = used_classes()
+    manifest = {}
+    for bundle, sources in sorted(BUNDLES.items()):
+        contents = [read_source(name, classes) for name in sources]
+        data = b''.join(contents) if isinstance(contents[0], bytes) else '\n'.join(contents).encode()
+
+        stem, ext = os.path.splitext(bundle)
+        filename = stem + '.' + hashlib.sha256(data).hexdigest()[:12] + ext
+        path = os.path.join(DIST, filename)
+        write_atomic(path, data)
+        if ext in ('.css', '.js'):
+            write_atomic(path + '.gz', gzip.compress(data, 9))
+            if brotli is not None:
+                write_atomic(path + '.br', brotli.compress(data))
+        manifest[bundle] = filename
+
+    write_atomic(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    # builds before the previous one; the previous build's files stay for pages rendered before this rebuild
+    current = set(manifest.values()) | set(previous.values())
+    for name in os.listdir(DIST):
+        base = name[:-3] if name.endswith(('.gz', '.br')) else name
+        if name != 'manifest.json' and not name.endswith('.tmp') and base not in current:
+            try:
+                os.remove(os.path.join(DIST, name))
+            except FileNotFoundError:
+                pass
+    return manifest
+
+
+def main():
+    manifest = build()
+    for bundle, filename in sorted(manifest.items()):
+        path = os.path.join(DIST, filename)
+        sizes = [os.path.getsize(path)] + [os.path.getsize(path + ext) for ext in ('.gz', '.br')
+                                           if os.path.exists(path + ext)]
+        print(f'{bundle} -> {filename}: ' + ' / '.join(f'{size / 1024:.1f} KB' for size in sizes), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import heapq
+
+import numpy as np
+
+from optimize import pair_arrays
+
+# Fair-share fill mode. Instead of the fixed score order, every schedulable pair sits in a priority queue keyed on
+#   (how many of the two are still under min_meetings, score / ((1 + meetings of one) * (1 + meetings of other)) ** f)
+# with f the fairness weight, so an entity's remaining requests lose priority as it collects meetings, and entities
+# below the minimum go first. Keys only ever go down, so they're updated lazily: a popped entry whose entities
+# gained meetings since it was pushed is re-keyed and pushed back, and every other entry is left alone. Entities at
+# max_meetings take no more. With fairness 0 and no quotas this is the greedy fill with every tie kept in sheet
+# order.
+
+
+def check_limits(min_meetings=0, max_meetings=None, fairness=1.0):
+    if fairness < 0:
+        raise ValueError('The fairness weight can\'t be negative.')
+    if min_meetings < 0 or (max_meetings is not None and max_meetings < max(min_meetings, 1)):
+        raise ValueError(f'Oops, the meeting limits don\'t fit together (at least {min_meetings}, '
+                         f'at most {max_meetings}).')
+
+
+def fill_fair(engine, df_requests_combined_sorted, request_index, min_meetings=0, max_meetings=None, fairness=1.0):
+    """Fill engine from the request list in fair-share order; returns a report like the other solvers'."""
+    check_limits(min_meetings, max_meetings, fairness)
+
+    rows, companies, investors, scores = pair_arrays(engine, df_requests_combined_sorted)
+    companies, investors, scores = companies.tolist(), investors.tolist(), scores.tolist()
+    # meetings typed into the schedule count towards both limits
+    counts = (engine.assigned >= 0).sum(axis=1).tolist()
+    cap = engine.num_meetings if max_meetings is None else max_meetings
+
+    def entry(k):
+        c, i = companies[k], investors[k]
+        under = (counts[c] < min_meetings) + (counts[i] < min_meetings)
+        weight = scores[k] / ((1 + counts[c]) * (1 + counts[i])) ** fairness
+        # the counts it was keyed with tell whether the key is stale; k keeps equal keys in sheet order
+        return -under, -weight, k, counts[c], counts[i]
+
+    heap = [entry(k) for k in range(len(companies))]
+    heapq.heapify(heap)
+    scheduled = np.zeros(len(companies), dtype=bool)
+    rekeyed = 0
+    while heap:
+        k, count_c, count_i = heap[0][2:]
+        c, i = companies[k], investors[k]
+        if counts[c] >= cap or counts[i] >= cap:
+            heapq.heappop(heap)
+        elif counts[c] != count_c or counts[i] != count_i:
+            heapq.heapreplace(heap, entry(k))
+            rekeyed += 1
+        else:
+            heapq.heappop(heap)
+            # slots only ever fill up, so a pair without a common slot now never gets one
+            slot = engine.earliest_common_slot(c, i)
+            if slot is not None:
+                engine.place(c, i, slot, request_index)
+                counts[c] += 1
+                counts[i] += 1
+                scheduled[k] = True
+
+    df_requests_combined_sorted.loc[df_requests_combined_sorted.index[rows[scheduled]], 'scheduled'] = True
+
+    # entities with at least one request (made or received) that could be placed
+    requesters = np.unique(np.concatenate([np.array(companies, dtype=np.int64), np.array(investors, dtype=np.int64)]))
+    met = np.array(counts)[requesters]
+    return {
+        'score': float(np.array(scores)[scheduled].sum()),
+        'scheduled': int(scheduled.sum()),
+        'min_meetings': min_meetings,
+        'max_meetings': max_meetings,
+        'fairness': fairness,
+        'below_minimum': [engine.entities[e] for e in requesters[met < min_meetings].tolist()],
+        'without_meetings': int((met == 0).sum()),
+        'rekeyed': rekeyed,
+    }
@@ -0,0 +1,263 @@
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import re
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from slot_engine import BACKUP, lookup_request_kind
+
+# Per-entity itineraries cut out of a finished df_schedule.csv, as one ZIP (csv/<entity>.csv, xlsx/<entity>.xlsx,
+# ics/<entity>.ics) that's written out entity by entity while the schedule is read in chunks, so the download
+# starts right away. Only the entity names stay in memory (a first pass reads the entity column to tell meeting
+# cells from typed-in blocks, and the ZIP's file names are kept unique), never the schedule's rows, e.g.
+#   python itineraries.py schedules/event/df_schedule.csv --date 2018-05-03 --start 09:00 --minutes 20
+# Every slot gets a row: who the meeting is with and whether this entity asked for it ('requested', 'backup' when
+# the request index is at hand, 'invited' when only the other side did), the blocked cell's text (N/A...) or 'free'.
+
+FORMATS = ('csv', 'xlsx', 'ics')
+COLUMNS = ['meeting', 'time', 'with', 'kind']
+MEETING_KINDS = ('requested', 'backup', 'invited')
+
+UNSAFE_FILENAME = re.compile(r'[^\w .-]+')
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Itinerary" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+
+
+def parse_start(date, start):
+    """The first meeting's start from the form's date (YYYY-MM-DD) and time (HH:MM) fields."""
+    try:
+        return datetime.datetime.strptime(date.strip() + ' ' + start.strip(), '%Y-%m-%d %H:%M')
+    except ValueError:
+        raise ValueError(f'Oops, \'{date} {start}\' isn\'t a date and time like 2018-05-03 09:00.')
+
+
+def parse_formats(formats):
+    formats = [fmt.strip().lower() for fmt in formats if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if not formats:
+        raise ValueError('Pick at least one itinerary format.')
+    if unknown:
+        raise ValueError(f'Unknown itinerary format \'{", ".join(unknown)}\' (expected {", ".join(FORMATS)}).')
+    return formats
+
+
+def read_schedule(path, chunksize=1000, **kwargs):
+    # strings throughout, so names that look like numbers stay as typed and 'N/A' stays 'N/A'
+    return pd.read_csv(path, index_col=0, dtype=str, keep_default_na=False, chunksize=chunksize, **kwargs)
+
+
+def iter_itineraries(path, request_index=None, chunksize=1000):
+    """(entity, [(meeting number, counterpart, kind), ...]) for every row of a df_schedule CSV, in order."""
+    # cells that name an entity are meetings, anything else typed in is a block (like SlotEngine.from_schedule)
+    entities = set()
+    for chunk in read_schedule(path, chunksize, usecols=[0, 1]):
+        entities.update(chunk['entity'].values)
+
+    for chunk in read_schedule(path, chunksize):
+        mtg_cols = [col for col in chunk.columns if col.startswith('mtg') and not col.endswith('_req')]
+        cells = chunk[mtg_cols].values
+        req_cols = [col + '_req' for col in mtg_cols]
+        if all(col in chunk.columns for col in req_cols):
+            requested = chunk[req_cols].values == 'True'
+        else:
+            requested = np.zeros(cells.shape, dtype=bool)
+
+        for entity, row, row_requested in zip(chunk['entity'].values, cells, requested):
+            rows = []
+            for meeting, (other, asked) in enumerate(zip(row, row_requested), 1):
+                if other == '':
+                    kind = 'free'
+                elif other not in entities:
+                    kind = other
+                    other = ''
+                elif not asked:
+                    kind = 'invited'
+                elif request_index is not None and lookup_request_kind(request_index, entity, other) == BACKUP:
+                    kind = 'backup'
+                else:
+                    kind = 'requested'
+                rows.append((meeting, other, kind))
+            yield entity, rows
+
+
+def to_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def _xlsx_cell(ref, value):
+    if isinstance(value, int):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def to_xlsx(rows):
+    """A one-sheet workbook, written straight as SpreadsheetML (no Excel library needed)."""
+    sheet_rows = []
+    for number, row in enumerate([COLUMNS] + list(rows), 1):
+        cells = ''.join(_xlsx_cell('ABCDEFGHIJ'[col] + str(number), value) for col, value in enumerate(row))
+        sheet_rows.append(f'<row r="{number}">{cells}</row>')
+    sheet = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+             '<sheetData>' + ''.join(sheet_rows) + '</sheetData></worksheet>')
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in XLSX_PARTS.items():
+            workbook.writestr(name, xml)
+        workbook.writestr('xl/worksheets/sheet1.xml', sheet)
+    return out.getvalue()
+
+
+def _ics_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_fold(line):
+    # content lines are at most 75 octets; longer ones continue on lines starting with a space
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    parts, current, size, limit = [], '', 0, 75
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > limit:
+            parts.append(current)
+            current, size, limit = '', 0, 74
+        current += char
+        size += width
+    return '\r\n '.join(parts + [current])
+
+
+def to_ics(entity, rows, first_start, minutes, stamp):
+    """A calendar with one event per meeting (blocks and free slots are left out)."""
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//mezzo-match//itineraries//EN', 'CALSCALE:GREGORIAN']
+    for meeting, _, other, kind in rows:
+        if kind not in MEETING_KINDS:
+            continue
+        begin = first_start + datetime.timedelta(minutes=minutes * (meeting - 1))
+        uid = hashlib.sha1(f'{entity}\0{meeting}\0{begin.isoformat()}'.encode('utf-8')).hexdigest()
+        lines += ['BEGIN:VEVENT',
+                  'UID:' + uid + '@mezzo-match',
+                  'DTSTAMP:' + stamp,
+                  'DTSTART:' + begin.strftime('%Y%m%dT%H%M%S'),
+                  'DTEND:' + (begin + datetime.timedelta(minutes=minutes)).strftime('%Y%m%dT%H%M%S'),
+                  'SUMMARY:' + _ics_text(f'Meeting {meeting}: {other}'),
+                  'DESCRIPTION:' + _ics_text(f'{entity} meets {other} ({kind})'),
+                  'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return ''.join(_ics_fold(line) + '\r\n' for line in lines).encode('utf-8')
+
+
+class _Chunks(object):
+    # write-only (unseekable) file for ZipFile; what's been written since the last take() goes out as one chunk
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        del self.buffer[:]
+        return data
+
+
+def _file_name(entity, used):
+    base = UNSAFE_FILENAME.sub('_', str(entity)).strip(' .') or 'entity'
+    name, copy = base, 1
+    while name.lower() in used:
+        copy += 1
+        name = f'{base} ({copy})'
+    used.add(name.lower())
+    return name
+
+
+def stream_itineraries(path, first_start, minutes=30, formats=FORMATS, request_index=None, chunksize=1000):
+    """Yield the itineraries ZIP in pieces, one entity's files at a time.
+
+    first_start is when meeting 1 begins; meeting N begins (N - 1) * minutes later.
+    """
+    if minutes <= 0:
+        raise ValueError('Meetings need to be at least a minute long.')
+    sink = _Chunks()
+    used = set()
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for entity, rows in iter_itineraries(path, request_index, chunksize):
+            name = _file_name(entity, used)
+            timed = [(meeting, (first_start + datetime.timedelta(minutes=minutes * (meeting - 1))).strftime('%H:%M'),
+                      other, kind) for meeting, other, kind in rows]
+            if 'csv' in formats:
+                archive.writestr(f'csv/{name}.csv', to_csv(timed))
+            if 'xlsx' in formats:
+                # already deflated inside
+                archive.writestr(f'xlsx/{name}.xlsx', to_xlsx(timed), compress_type=zipfile.ZIP_STORED)
+            if 'ics' in formats:
+                archive.writestr(f'ics/{name}.ics', to_ics(entity, timed, first_start, minutes, stamp))
+            yield sink.take()
+    yield sink.take()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Split a finished schedule into per-entity itineraries (ZIP).')
+    parser.add_argument('schedule', help='df_schedule.csv from the download page or batch.py')
+    parser.add_argument('--output', default='itineraries.zip')
+    parser.add_argument('--date', default=datetime.date.today().isoformat(), help='event date, YYYY-MM-DD')
+    parser.add_argument('--start', default='09:00', help='when meeting 1 starts, HH:MM')
+    parser.add_argument('--minutes', type=int, default=30, help='length of each meeting slot')
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS), choices=FORMATS)
+    args = parser.parse_args(argv)
+
+    with open(args.output, 'wb') as f:
+        for piece in stream_itineraries(args.schedule, parse_start(args.date, args.start), args.minutes,
+                                        args.formats):
+            f.write(piece)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
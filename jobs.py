@@ -0,0 +1,132 @@
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+
+import metrics
+from workspace import job_path, locked
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# status['status'] goes queued -> running -> done (or failed)
+ACTIVE = ('queued', 'running')
+
+# a queued or running job is taken as failed once it's this old (seconds since it was submitted), or once the
+# process that would record its result (the one that submitted it) is gone
+JOB_TIMEOUT = 60 * 60
+
+
+def get_executor(max_workers=None):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        return _executor
+
+
+def write_status(folder, job_id, status):
+    # status.json in the job's folder is what every web worker polls, so replace it atomically
+    path = job_path(folder, job_id, 'status.json')
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(dict(status, updated=time.time()), f)
+    os.replace(tmp_path, path)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)  # signal 0 only checks the process exists
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # it exists, under another user
+    return True
+
+
+def read_status(folder, job_id, timeout=JOB_TIMEOUT):
+    try:
+        with open(job_path(folder, job_id, 'status.json')) as f:
+            status = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    # nobody is left to finish a job whose web worker died (or that hung), so don't keep the organizer waiting
+    if status['status'] in ACTIVE and 'started' in status:
+        if time.time() - status['started'] > timeout:
+            return dict(status, status='failed', error='The scheduling job took too long and was stopped.')
+        if not _process_alive(status['pid']):
+            return dict(status, status='failed', error='The scheduling job was interrupted (the server restarted).')
+    return status
+
+
+def is_active(folder, job_id, timeout=JOB_TIMEOUT):
+    status = read_status(folder, job_id, timeout)
+    return status is not None and status['status'] in ACTIVE
+
+
+class ProgressReporter(object):
+    """Called by a running job after every score group; writes at most one status update per interval."""
+
+    def __init__(self, folder, job_id, interval=0.25):
+        self.folder = folder
+        self.job_id = job_id
+        self.interval = interval
+        self.last_write = 0
+        # progress updates keep the submitter's start time and pid for the staleness check
+        status = read_status(folder, job_id) or {}
+        self.owner = {key: status[key] for key in ('started', 'pid') if key in status}
+
+    def __call__(self, done, total, force=False):
+        now = time.time()
+        if force or now - self.last_write >= self.interval:
+            write_status(self.folder, self.job_id, dict(self.owner, **{
+                'status': 'running',
+                'done': done,
+                'total': total,
+                'progress': str(done) + ' out of ' + str(total),
+            }))
+            self.last_write = now
+
+
+def mark_queued(folder, job_id):
+    """Mark the job queued; done under the job's lock, so no other request starts a second job before submit()."""
+    write_status(folder, job_id, {'status': 'queued', 'started': time.time(), 'pid': os.getpid()})
+
+
+def submit(folder, job_id, fn, args, on_done, max_workers=None):
+    """Run fn(*args) in the process pool; on_done(result) runs in this process and returns the status payload.
+
+    on_done and the final status update take the job's lock, like the requests that read them, so call this after
+    mark_queued() and once the lock is released: a callback for a future that's already done runs right away on
+    the calling thread.
+    """
+    def finish(future):
+        with locked(folder, job_id):
+            try:
+                payload = on_done(future.result())
+            except Exception as err:
+                metrics.inc('jobs_failed')
+                write_status(folder, job_id, {'status': 'failed', 'error': str(err)})
+            else:
+                metrics.inc('jobs_finished')
+                write_status(folder, job_id, dict(payload, status='done'))
+
+    future = get_executor(max_workers).submit(fn, *args)
+    future.add_done_callback(finish)
+    return future
+
+
+def run_inline(folder, job_id, fn, args, on_done):
+    """Same as submit(), but in the calling thread (for BACKGROUND_JOBS=0 and tests); the caller holds the lock."""
+    write_status(folder, job_id, {'status': 'running', 'started': time.time(), 'pid': os.getpid()})
+    try:
+        payload = on_done(fn(*args))
+    except Exception as err:
+        metrics.inc('jobs_failed')
+        write_status(folder, job_id, {'status': 'failed', 'error': str(err)})
+    else:
+        metrics.inc('jobs_finished')
+        write_status(folder, job_id, dict(payload, status='done'))
@@ -0,0 +1,282 @@
+import argparse
+import collections
+import http.cookiejar
+import io
+import json
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import numpy as np
+
+from benchmark import git_revision
+from synthetic import generate_event, generate_unavailability
+
+# Load test for the organizer flow: every virtual user runs whole sessions (upload a synthetic event, download
+# the blank schedule, submit it with bulk unavailability, answer every tie prompt with SAME) and the latency of
+# each route is recorded, e.g.
+#   python loadtest.py --users 16 --sessions 3 --output load.json             # in-process, Flask's test client
+#   python loadtest.py --url http://127.0.0.1:8000 --users 16 --baseline load.json    # a running gunicorn
+# Polls of /jobs/<job id> count as requests too. Compare runs made the same way: the test client shares one
+# process (and the GIL) with the virtual users, gunicorn doesn't.
+
+SCHEDULE_LINK = re.compile(rb'<a href=(\S+)> Schedule</a>')
+JOB_ID = re.compile(rb'/jobs/([0-9a-f]{32})')
+
+
+class TestClientSession(object):
+    """One organizer's browser, talking to the app in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, fields=(), files=()):
+        data = {}
+        for name, value in fields:
+            data.setdefault(name, []).append(value)
+        for name, filename, content in files:
+            data[name] = (io.BytesIO(content), filename)
+        response = self.client.open(path, method=method, data=data or None)
+        return response.status_code, response.headers.get('Location'), response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # redirects are followed (and timed) by the session itself
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HTTPSession(object):
+    """One organizer's browser, talking to a running server over HTTP (with its own cookies)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def request(self, method, path, fields=(), files=()):
+        body = None
+        headers = {}
+        if fields or files:
+            body, content_type = encode_multipart(fields, files)
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(urllib.parse.urljoin(self.base_url + '/', path), data=body, headers=headers,
+                                     method=method)
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.headers.get('Location'), response.read()
+        except urllib.error.HTTPError as err:
+            return err.code, err.headers.get('Location'), err.read()
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: text/csv\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), 'multipart/form-data; boundary=' + boundary
+
+
+class RouteStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def summary(self, duration):
+        routes = collections.OrderedDict()
+        for route, latencies in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            routes[route] = {'requests': len(latencies), 'errors': self.errors[route],
+                             'error_rate': self.errors[route] / len(latencies),
+                             'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                             'throughput': len(latencies) / duration if duration else 0.0}
+        return routes
+
+
+class VirtualUser(object):
+    def __init__(self, session, stats, poll_interval=0.05, max_prompts=500):
+        self.session = session
+        self.stats = stats
+        self.poll_interval = poll_interval
+        self.max_prompts = max_prompts
+
+    def call(self, route, method, path, fields=(), files=()):
+        start = time.perf_counter()
+        status, location, body = self.session.request(method, path, fields, files)
+        ok = status < 400 and b'Something went wrong' not in body
+        self.stats.record(route, time.perf_counter() - start, ok)
+        return status, location, body
+
+    def settle(self, status, location, body):
+        # follow a finished inline job's redirect, or poll a background job the way progress.html does
+        if status in (301, 302, 303):
+            status, location, body = self.call('job_result', 'GET', location)
+        while b'Scheduling...' in body:
+            job_id = JOB_ID.search(body).group(1).decode()
+            while True:
+                _, _, status_body = self.call('job_status', 'GET', '/jobs/' + job_id)
+                job = json.loads(status_body.decode())
+                if job['status'] not in ('queued', 'running'):
+                    break
+                time.sleep(self.poll_interval)
+            status, location, body = self.call('job_result', 'GET', '/jobs/' + job_id + '/result')
+        return status, location, body
+
+    def run_session(self, event_csv, unavailable_csv):
+        """One organizer from upload to download; returns True if it got to the download page."""
+        _, _, body = self.call('upload', 'POST', '/upload', files=[('file', 'event.csv', event_csv)])
+        link = SCHEDULE_LINK.search(body)
+        if link is None:
+            return False
+        _, _, schedule_csv = self.call('schedule_csv', 'GET', link.group(1).decode())
+
+        response = self.call('schedule_unavailability', 'POST', '/schedule_unavailability',
+                             fields=[('tie_policy', 'interactive')],
+                             files=[('file', 'df_schedule.csv', schedule_csv),
+                                    ('unavailability', 'unavailable.csv', unavailable_csv)])
+        status, location, body = self.settle(*response)
+        for _ in range(self.max_prompts):
+            if b'Breaking ties' not in body:
+                break
+            fields = [('order', 'SAME')] * body.count(b'name="order"')
+            status, location, body = self.settle(*self.call('break_ties', 'POST', '/break_ties', fields=fields))
+        return b'LAST STEP' in body
+
+
+def make_events(num_users, num_sessions, args):
+    # every session gets its own event, so the result cache can't answer for it
+    events = {}
+    for user in range(num_users):
+        for session in range(num_sessions):
+            seed = args.seed + user * num_sessions + session
+            df_event = generate_event(args.companies, args.investors, args.choices, args.backups, seed=seed)
+            df_unavailable = generate_unavailability(df_event, args.choices, args.density, seed)
+            events[user, session] = (df_event.to_csv(index=False).encode(), df_unavailable.to_csv(index=False).encode())
+    return events
+
+
+def run_load(make_session, num_users, num_sessions, events, poll_interval=0.05):
+    """Run num_users virtual users at once, each doing num_sessions sessions.
+
+    Returns (stats, outcomes, failures, seconds); failures has the user, session and error of every failed session.
+    """
+    stats = RouteStats()
+    outcomes = collections.Counter()
+    failures = []
+    lock = threading.Lock()
+
+    def user_loop(user):
+        virtual_user = VirtualUser(make_session(), stats, poll_interval)
+        for session in range(num_sessions):
+            error = None
+            try:
+                finished = virtual_user.run_session(*events[user, session])
+            except Exception as err:
+                finished = False
+                error = f'{type(err).__name__}: {err}'
+            with lock:
+                outcomes['finished' if finished else 'failed'] += 1
+                if not finished:
+                    failures.append({'user': user, 'session': session,
+                                     'error': error or 'did not get to the download page'})
+
+    threads = [threading.Thread(target=user_loop, args=(user,)) for user in range(num_users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, outcomes, failures, time.perf_counter() - start
+
+
+def compare(routes, baseline):
+    # p95 against the baseline run's, per route
+    lines = []
+    for route, result in routes.items():
+        old = baseline['routes'].get(route)
+        if old and old['p95_ms']:
+            lines.append(f'{route}: p95 {result["p95_ms"]:.0f}ms vs {old["p95_ms"]:.0f}ms '
+                         f'({result["p95_ms"] / old["p95_ms"]:.2f}x)')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the upload / unavailability / tie-break routes.')
+    parser.add_argument('--url', help='base URL of a running server; default is the app in this process')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--sessions', type=int, default=2, help='sessions per virtual user')
+    parser.add_argument('--companies', type=int, default=40)
+    parser.add_argument('--investors', type=int, default=20)
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--backups', type=int, default=2)
+    parser.add_argument('--density', type=float, default=0.05, help='share of unavailable slots')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='seconds between /jobs/<id> polls')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='an earlier --output file to compare p95 latencies against')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.url:
+        def make_session():
+            return HTTPSession(args.url)
+    else:
+        from app import app
+
+        def make_session():
+            return TestClientSession(app)
+
+    events = make_events(args.users, args.sessions, args)
+    stats, outcomes, failures, duration = run_load(make_session, args.users, args.sessions, events, args.poll_interval)
+    routes = stats.summary(duration)
+    requests = sum(result['requests'] for result in routes.values())
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'parameters': vars(args),
+        'seconds': duration,
+        'sessions_finished': outcomes['finished'],
+        'sessions_failed': outcomes['failed'],
+        'sessions_per_second': outcomes['finished'] / duration if duration else 0.0,
+        'requests_per_second': requests / duration if duration else 0.0,
+        'routes': routes,
+        'failures': failures,
+    }
+
+    for route, result in routes.items():
+        print(f'{route}: {result["requests"]} requests, p50 {result["p50_ms"]:.0f}ms p95 {result["p95_ms"]:.0f}ms '
+              f'p99 {result["p99_ms"]:.0f}ms, {result["error_rate"]:.1%} errors', file=sys.stderr)
+    print(f'{outcomes["finished"]} sessions finished, {outcomes["failed"]} failed in {duration:.1f}s '
+          f'({report["requests_per_second"]:.1f} requests/s)', file=sys.stderr)
+    for failure in failures:
+        print(f'user {failure["user"]} session {failure["session"]} failed: {failure["error"]}', file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            for line in compare(routes, json.load(f)):
+                print(line, file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 1 if outcomes['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
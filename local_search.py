@@ -0,0 +1,176 @@
+import time
+
+import numpy as np
+
+from optimize import alternating_path
+from slot_engine import BLOCKED, FREE
+
+# Optional clean-up pass after the greedy fill. Each unscheduled request (best score first) tries, in order:
+#   1. a slot both sides have open (freed up by an earlier move),
+#   2. a swap chain: exchanging two slots along an alternating path of meetings, which keeps every meeting,
+#   3. for every slot (reading only the two entities' rows and free masks): move the meetings in the way to another
+#      open slot, or eject them if that still gains score. Ejected requests go through the same steps again (an
+#      ejection chain).
+# Every applied step strictly raises the total score, N/A blocks are never touched and fixed meetings never move.
+
+MAX_CHAIN = 3
+
+
+class LocalSearch(object):
+    def __init__(self, engine, df_requests_combined_sorted, request_index, fixed=None):
+        self.engine = engine
+        self.request_index = request_index
+        self.fixed = np.zeros(engine.assigned.shape, dtype=bool) if fixed is None else fixed
+
+        self.pair_ids = np.array([[engine.ids.get(e1, -1), engine.ids.get(e2, -1)] for e1, e2 in zip(
+            df_requests_combined_sorted['entity1'].values, df_requests_combined_sorted['entity2'].values)],
+            dtype=np.int64).reshape(-1, 2)
+        self.scores = df_requests_combined_sorted['score'].values.astype(float)
+        self.scheduled = df_requests_combined_sorted['scheduled'].values.astype(bool)
+
+        # request row of every requested pair, looked up by the pair's key (lower ID * n + higher ID) in a sorted
+        # array, so memory grows with the request list rather than entities squared
+        self.num_entities = n = len(engine.entities)
+        known = np.flatnonzero((self.pair_ids >= 0).all(axis=1))
+        keys = self.pair_ids[known].min(axis=1) * n + self.pair_ids[known].max(axis=1)
+        order = np.argsort(keys, kind='mergesort')
+        keys, rows = keys[order], known[order]
+        last = np.append(keys[1:] != keys[:-1], True)  # a pair requested twice maps to its last row
+        self.pair_keys, self.pair_rows = keys[last], rows[last]
+
+    def rows_of(self, e, partners):
+        """Request row of each (e, partner) pair, -1 for pairs nobody requested."""
+        keys = np.minimum(e, partners) * self.num_entities + np.maximum(e, partners)
+        if not len(self.pair_keys):
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        return np.where(self.pair_keys[pos] == keys, self.pair_rows[pos], -1)
+
+    def total_score(self):
+        return float(self.scores[self.scheduled].sum())
+
+    def insert(self, k, depth=0):
+        """Try to schedule request row k; returns True if it was placed (total score went up)."""
+        u, v = (int(e) for e in self.pair_ids[k])
+        if u < 0 or v < 0 or self.scheduled[k]:
+            return False
+        engine = self.engine
+
+        slot = engine.earliest_common_slot(u, v)
+        if slot is not None:
+            self.place(k, u, v, slot)
+            return True
+
+        if self.swap_in(k, u, v):
+            return True
+
+        if depth >= MAX_CHAIN:
+            return False
+
+        # delta score of clearing each slot for u and v: 0 if free or the meeting can move, minus its score if it
+        # has to be ejected, -inf if blocked or fixed. Only u's and v's rows and free masks are read.
+        masks = engine.free_masks
+        delta = [float(self.scores[k])] * engine.assigned.shape[1]
+        ejections = []
+        for e in (u, v):
+            stuck_slots, stuck_partners = [], []
+            for slot, (partner, fixed) in enumerate(zip(engine.assigned[e].tolist(), self.fixed[e].tolist())):
+                if partner == BLOCKED or fixed:
+                    delta[slot] = -np.inf
+                elif partner >= 0 and not masks[e] & masks[partner]:
+                    stuck_slots.append(slot)
+                    stuck_partners.append(partner)
+            # meetings that can't move are ejected; only meetings from the request list can be
+            ejects = dict(zip(stuck_slots, self.rows_of(e, np.array(stuck_partners, dtype=np.int64)).tolist()))
+            for slot, row in ejects.items():
+                delta[slot] = delta[slot] - self.scores[row] if row >= 0 else -np.inf
+            ejections.append(ejects)
+
+        slot = int(np.argmax(delta))
+        if not delta[slot] > 1e-9:
+            return False
+
+        ejected = []
+        for e, ejects in zip((u, v), ejections):
+            partner = int(engine.assigned[e, slot])
+            if partner < 0:
+                continue
+            target = engine.earliest_common_slot(e, partner)
+            engine.remove(e, partner, slot)
+            if slot in ejects:
+                self.scheduled[ejects[slot]] = False
+                ejected.append(ejects[slot])
+            else:
+                engine.place(e, partner, target, self.request_index)
+
+        self.place(k, u, v, slot)
+        for row in ejected:
+            self.insert(row, depth + 1)
+        return True
+
+    def swap_in(self, k, u, v):
+        # u open in a and v open in b: swap the a/b meetings along v's alternating path so v opens up in a
+        engine = self.engine
+        free_u = np.flatnonzero(engine.assigned[u] == FREE)
+        free_v = np.flatnonzero(engine.assigned[v] == FREE)
+        for a in free_u:
+            if engine.assigned[v, a] == BLOCKED:
+                continue
+            for b in free_v:
+                if engine.assigned[u, b] == BLOCKED:
+                    continue
+                path = alternating_path(engine.assigned, self.fixed, v, a, b)
+                if path is None:
+                    continue
+                self.swap_path([int(x) for x in path], int(a), int(b))
+                self.place(k, u, v, int(a))
+                return True
+        return False
+
+    def swap_path(self, path, a, b):
+        engine = self.engine
+        meetings = []
+        colour = a
+        for x, y in zip(path, path[1:]):
+            meetings.append((x, y, colour))
+            colour = b if colour == a else a
+        for x, y, colour in meetings:
+            engine.remove(x, y, colour)
+        for x, y, colour in meetings:
+            engine.place(x, y, b if colour == a else a, self.request_index)
+
+    def place(self, k, u, v, slot):
+        self.engine.place(u, v, slot, self.request_index)
+        self.scheduled[k] = True
+
+
+def improve_schedule(engine, df_requests_combined_sorted, request_index, time_limit=5.0, fixed=None):
+    """Local search over a filled schedule for at most time_limit seconds; updates both in place.
+
+    fixed[e, s] marks meetings that must stay where they are (e.g. the ones already in the uploaded schedule).
+    """
+    deadline = time.time() + time_limit
+    search = LocalSearch(engine, df_requests_combined_sorted, request_index, fixed)
+    score_before = search.total_score()
+    count_before = int(search.scheduled.sum())
+
+    timed_out = False
+    improved = True
+    while improved and not timed_out:
+        improved = False
+        for k in np.flatnonzero(~search.scheduled):
+            if time.time() >= deadline:
+                timed_out = True
+                break
+            if not search.scheduled[k] and search.insert(k):
+                improved = True
+
+    df_requests_combined_sorted['scheduled'] = search.scheduled
+    score = search.total_score()
+    return {
+        'score_before': score_before,
+        'score': score,
+        'recovered_score': score - score_before,
+        'recovered_requests': int(search.scheduled.sum()) - count_before,
+        'timed_out': timed_out,
+    }
@@ -0,0 +1,96 @@
+import collections
+import contextlib
+import threading
+import time
+
+# In-process metrics for the /metrics endpoint (Prometheus text format). Stage timings are histograms labelled by
+# stage, everything else is a plain counter. Fill jobs run in the process pool, so each job sends back what it
+# recorded (Registry.diff) and the web process merges it in. With several gunicorn workers every worker exposes
+# its own numbers, like prometheus_client without its multiprocess mode.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+COUNTERS = collections.OrderedDict([
+    ('requests', 'Company/investor request pairs ingested from uploads.'),
+    ('meetings_scheduled', 'Meetings placed by the fill.'),
+    ('meetings_unscheduled', 'Requests the fill tried to place but found no common slot for.'),
+    ('groups_processed', 'Score groups filled.'),
+    ('jobs_finished', 'Fill jobs that finished.'),
+    ('jobs_failed', 'Fill jobs that raised an error.'),
+    ('cache_hits', 'Uploads and fill steps served from the result cache.'),
+    ('cache_misses', 'Uploads and fill steps that had to be computed (and were cached).'),
+    ('itinerary_exports', 'Itinerary ZIPs downloaded.'),
+])
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.stages = collections.OrderedDict()  # stage -> [bucket counts..., count, sum]
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            series = self.stages.setdefault(stage, [0] * len(BUCKETS) + [0, 0.0])
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'stages': collections.OrderedDict((stage, list(series)) for stage, series in self.stages.items())}
+
+    def diff(self, before):
+        """What was recorded since snapshot() returned before."""
+        after = self.snapshot()
+        counters = {name: value - before['counters'].get(name, 0) for name, value in after['counters'].items()}
+        stages = collections.OrderedDict()
+        for stage, series in after['stages'].items():
+            old = before['stages'].get(stage, [0] * len(series))
+            if series[-2] != old[-2]:
+                stages[stage] = [new - prev for new, prev in zip(series, old)]
+        return {'counters': counters, 'stages': stages}
+
+    def merge(self, delta):
+        with self._lock:
+            for name, value in delta['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for stage, series in delta['stages'].items():
+                current = self.stages.setdefault(stage, [0] * len(BUCKETS) + [0, 0.0])
+                self.stages[stage] = [a + b for a, b in zip(current, series)]
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = ['# HELP mezzo_stage_seconds Time spent in each pipeline stage.',
+                 '# TYPE mezzo_stage_seconds histogram']
+        for stage, series in snapshot['stages'].items():
+            for bound, count in zip(BUCKETS, series):
+                lines.append(f'mezzo_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'mezzo_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {series[-2]}')
+            lines.append(f'mezzo_stage_seconds_sum{{stage="{stage}"}} {series[-1]}')
+            lines.append(f'mezzo_stage_seconds_count{{stage="{stage}"}} {series[-2]}')
+        for name, help_text in COUNTERS.items():
+            lines.append(f'# HELP mezzo_{name}_total {help_text}')
+            lines.append(f'# TYPE mezzo_{name}_total counter')
+            lines.append(f'mezzo_{name}_total {snapshot["counters"][name]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+inc = registry.inc
+span = registry.span
@@ -0,0 +1,298 @@
+import heapq
+import time
+
+import numpy as np
+
+from slot_engine import BLOCKED, FREE
+
+# Exact scheduler mode. Dropping the "one meeting per slot" coupling turns scheduling into a max-weight
+# b-matching (each entity takes at most as many meetings as it has open slots), which is solved exactly with a
+# min-cost flow. By Konig's edge-colouring theorem a bipartite b-matching always fits into the slots, so the
+# matching is laid out with alternating-path (Kempe chain) swaps. Without N/A blocks that gives a provably optimal
+# schedule; with blocks the matching value is still an upper bound, used to report the optimality gap.
+
+
+def pair_arrays(engine, df_requests_combined_sorted):
+    """Integer (company, investor, score) arrays for the pairs that can still be scheduled, in row order."""
+    entity1_ids = np.array([engine.ids.get(e, -1) for e in df_requests_combined_sorted['entity1'].values])
+    entity2_ids = np.array([engine.ids.get(e, -1) for e in df_requests_combined_sorted['entity2'].values])
+    known = (entity1_ids >= 0) & (entity2_ids >= 0)
+
+    rows = np.flatnonzero(known)
+    companies = entity1_ids[rows]
+    investors = entity2_ids[rows]
+    scores = df_requests_combined_sorted['score'].values[rows].astype(float)
+
+    # pairs that already meet (manually fixed meetings) or have no open slot in common are out
+    already_met = (engine.assigned[companies] == investors[:, None]).any(axis=1)
+    shared = np.array([engine.common_free(c, i) != 0 for c, i in zip(companies, investors)], dtype=bool)
+    keep = ~already_met & shared
+    return rows[keep], companies[keep], investors[keep], scores[keep]
+
+
+def open_slot_counts(engine):
+    return np.array([bin(mask).count('1') for mask in engine.free_masks])
+
+
+def upper_bound_by_side(engine, companies, investors, scores):
+    # each entity can take at most its open slots' worth of its best pairs; either side alone is a valid bound
+    caps = open_slot_counts(engine)
+    bounds = []
+    for side in (companies, investors):
+        total = 0.0
+        order = np.lexsort((-scores, side))
+        side_sorted = side[order]
+        starts = np.flatnonzero(np.r_[True, side_sorted[1:] != side_sorted[:-1]])
+        ends = np.r_[starts[1:], len(side_sorted)]
+        for start, end in zip(starts, ends):
+            total += scores[order[start:min(end, start + caps[side_sorted[start]])]].sum()
+        bounds.append(total)
+    return min(bounds)
+
+
+class _FlowGraph(object):
+    def __init__(self, num_nodes):
+        self.adj = [[] for _ in range(num_nodes)]
+        self.to = []
+        self.cap = []
+        self.cost = []
+
+    def add_edge(self, u, v, cap, cost):
+        # edge e and its reverse e ^ 1
+        self.adj[u].append(len(self.to))
+        self.to.append(v)
+        self.cap.append(cap)
+        self.cost.append(cost)
+        self.adj[v].append(len(self.to))
+        self.to.append(u)
+        self.cap.append(0)
+        self.cost.append(-cost)
+        return len(self.to) - 2
+
+
+def max_weight_b_matching(caps, companies, investors, scores, deadline):
+    """Pick pairs maximizing total score with at most caps[e] pairs per entity (min-cost flow, primal-dual).
+
+    Returns (chosen, complete): a boolean mask over the pairs and whether the optimum was reached before the
+    deadline. Every intermediate flow is itself a valid (smaller) matching.
+    """
+    n = len(caps)
+    source, sink = n, n + 1
+    graph = _FlowGraph(n + 2)
+    for c in np.unique(companies):
+        graph.add_edge(source, int(c), int(caps[c]), 0)
+    for i in np.unique(investors):
+        graph.add_edge(int(i), sink, int(caps[i]), 0)
+    pair_edges = [graph.add_edge(int(c), int(i), 1, -float(w)) for c, i, w in zip(companies, investors, scores)]
+
+    to, cap, cost, adj = graph.to, graph.cap, graph.cost, graph.adj
+    inf = float('inf')
+
+    # initial potentials make every reduced cost non-negative (the graph is a DAG source -> co -> inv -> sink)
+    potential = [0.0] * (n + 2)
+    for c, i, w in zip(companies, investors, scores):
+        potential[i] = min(potential[i], -float(w))
+    potential[sink] = min([potential[i] for i in np.unique(investors)] or [0.0])
+
+    complete = False
+    while time.time() < deadline:
+        # Dijkstra on reduced costs
+        dist = [inf] * (n + 2)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            pu = potential[u]
+            for e in adj[u]:
+                if cap[e] > 0:
+                    v = to[e]
+                    nd = d + cost[e] + pu - potential[v]
+                    if nd < dist[v] - 1e-12:
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+
+        if dist[sink] == inf:
+            complete = True
+            break
+        limit = dist[sink]
+        for v in range(n + 2):
+            potential[v] += min(dist[v], limit)
+        if potential[sink] - potential[source] >= -1e-12:
+            # the cheapest augmenting path no longer adds score
+            complete = True
+            break
+
+        # push flow along every shortest (zero reduced cost) path before running Dijkstra again
+        dead = [False] * (n + 2)
+        while time.time() < deadline:
+            path = _find_admissible_path(source, sink, adj, to, cap, cost, potential, dead)
+            if path is None:
+                break
+            push = min(cap[e] for e in path)
+            for e in path:
+                cap[e] -= push
+                cap[e ^ 1] += push
+
+    chosen = np.array([cap[e] == 0 for e in pair_edges], dtype=bool)
+    return chosen, complete
+
+
+def _find_admissible_path(source, sink, adj, to, cap, cost, potential, dead):
+    on_path = {source}
+    stack = [(source, iter(adj[source]))]
+    path = []
+    while stack:
+        u, edges = stack[-1]
+        advanced = False
+        for e in edges:
+            v = to[e]
+            if cap[e] > 0 and not dead[v] and v not in on_path and \
+                    abs(cost[e] + potential[u] - potential[v]) < 1e-9:
+                path.append(e)
+                if v == sink:
+                    return path
+                on_path.add(v)
+                stack.append((v, iter(adj[v])))
+                advanced = True
+                break
+        if not advanced:
+            dead[u] = True
+            stack.pop()
+            on_path.discard(u)
+            if path:
+                path.pop()
+    return None
+
+
+def lay_out_matching(engine, companies, investors, max_tries=None):
+    """Give every matched pair a slot, swapping along alternating paths when no common slot is open.
+
+    Works on a copy of engine.assigned and returns {(company, investor): slot} for the pairs that were placed.
+    Meetings already in the engine (manual ones) never move.
+    """
+    grid = engine.assigned.tolist()
+    fixed = (engine.assigned >= 0).tolist()
+    num_slots = engine.num_meetings
+    placed = {}
+
+    def free_slots(e):
+        return [s for s in range(num_slots) if grid[e][s] == FREE]
+
+    for u, v in zip(companies.tolist(), investors.tolist()):
+        common = [s for s in range(num_slots) if grid[u][s] == FREE and grid[v][s] == FREE]
+        if common:
+            grid[u][common[0]] = v
+            grid[v][common[0]] = u
+            placed[(u, v)] = common[0]
+            continue
+
+        tries = 0
+        done = False
+        for a in free_slots(u):
+            if grid[v][a] == BLOCKED:
+                continue
+            for b in free_slots(v):
+                if grid[u][b] == BLOCKED:
+                    continue
+                tries += 1
+                path = alternating_path(grid, fixed, v, a, b)
+                if path is not None:
+                    _swap_path(grid, path, a, b, placed)
+                    grid[u][a] = v
+                    grid[v][a] = u
+                    placed[(u, v)] = a
+                    done = True
+                    break
+                if max_tries is not None and tries >= max_tries:
+                    break
+            if done or (max_tries is not None and tries >= max_tries):
+                break
+
+    return placed
+
+
+def alternating_path(grid, fixed, start, a, b):
+    # the chain start -a- x1 -b- x2 -a- ...; None if it runs into a fixed meeting or would land in a blocked slot
+    path = [start]
+    colour, other = a, b
+    x = start
+    while True:
+        y = grid[x][colour]
+        if y == FREE:
+            return path
+        if y == BLOCKED:
+            # x keeps its meeting in `other`, which would have to move into this blocked slot
+            return None if len(path) > 1 else path
+        if fixed[x][colour]:
+            return None
+        path.append(y)
+        x = y
+        colour, other = other, colour
+        if len(path) > len(grid) + 1:
+            return None
+
+
+def _swap_path(grid, path, a, b, placed):
+    # swap the a/b meetings along the chain
+    moves = []
+    colour = a
+    for x, y in zip(path, path[1:]):
+        moves.append((x, y, colour))
+        colour = b if colour == a else a
+    for x, y, colour in moves:
+        grid[x][colour] = FREE
+        grid[y][colour] = FREE
+    for x, y, colour in moves:
+        new = b if colour == a else a
+        grid[x][new] = y
+        grid[y][new] = x
+        key = (x, y) if (x, y) in placed else (y, x)
+        placed[key] = new
+
+
+def solve_exact(engine, df_requests_combined_sorted, request_index, time_budget=10.0):
+    """Fill engine to (close to) the maximum total score within time_budget seconds.
+
+    Pairs left over by the matching (or whose layout failed because of N/A blocks) are added greedily in score
+    order at the end. Returns a report with the total score and the upper bound used for the optimality gap.
+    """
+    deadline = time.time() + time_budget
+    rows, companies, investors, scores = pair_arrays(engine, df_requests_combined_sorted)
+
+    chosen, complete = max_weight_b_matching(open_slot_counts(engine), companies, investors, scores, deadline)
+    if complete:
+        upper_bound = float(scores[chosen].sum())
+    else:
+        upper_bound = float(upper_bound_by_side(engine, companies, investors, scores))
+
+    order = np.flatnonzero(chosen)
+    order = order[np.argsort(-scores[order], kind='mergesort')]
+    placed = lay_out_matching(engine, companies[order], investors[order])
+
+    scheduled = np.zeros(len(rows), dtype=bool)
+    for k, (c, i) in enumerate(zip(companies.tolist(), investors.tolist())):
+        slot = placed.get((c, i))
+        if slot is not None:
+            engine.place(c, i, slot, request_index)
+            scheduled[k] = True
+
+    # greedy top-up with whatever still fits
+    for k in np.flatnonzero(~scheduled):
+        slot = engine.earliest_common_slot(companies[k], investors[k])
+        if slot is not None:
+            engine.place(companies[k], investors[k], slot, request_index)
+            scheduled[k] = True
+
+    df_requests_combined_sorted.loc[df_requests_combined_sorted.index[rows[scheduled]], 'scheduled'] = True
+    total = float(scores[scheduled].sum())
+
+    return {
+        'score': total,
+        'upper_bound': upper_bound,
+        'gap': (upper_bound - total) / upper_bound if upper_bound > 0 else 0.0,
+        'optimal': complete and total >= upper_bound - 1e-9,
+        'timed_out': not complete,
+        'scheduled': int(scheduled.sum()),
+    }
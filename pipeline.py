@@ -0,0 +1,515 @@
+import collections
+import copy
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from request_graph import RequestGraph
+from slot_engine import SlotEngine
+from tie_cursor import TieCursor
+from tie_policies import same_order
+
+# The scheduling pipeline (ingest -> schedule -> fill -> late changes) without the web app around it, so the
+# batch CLI and the benchmark can use it without importing Flask. The other solvers and the late-change code are
+# imported where they're used; metrics stays at the top since every fill step records into it.
+
+logger = logging.getLogger('mezzo_match')
+
+# how much a backup choice counts next to a main choice (scores are weight x importance x importance)
+BACKUP_WEIGHT = 0.5
+
+
+def build_entity_index(df):
+    # One row per entity (first occurrence wins, like the old df[df['entity'] == x].iloc[0] lookups); the
+    # position of an entity in this index is its integer ID
+    entity_index = df[['entity', 'type', 'importance']].drop_duplicates(subset=['entity'])
+    return entity_index.set_index('entity')
+
+
+def build_request_index(df_requests):
+    # Directed request lookup: (requester, requested) -> True if it was only a backup choice
+    choice_cols = [s for s in list(df_requests) if 'choice_' in s or 'backup_' in s]
+    # column by column, like melting the choice columns
+    requested = df_requests[choice_cols].values.ravel(order='F')
+    entities = np.tile(df_requests['entity'].values, len(choice_cols))
+    is_backup = np.repeat(['choice_' not in col for col in choice_cols], len(df_requests))
+    filled = pd.notnull(requested) & (requested != '')
+
+    # main choices win over backups when an entity listed someone in both
+    backup = filled & is_backup
+    main = filled & ~is_backup
+    request_index = dict.fromkeys(zip(entities[backup].tolist(), requested[backup].tolist()), True)
+    request_index.update(dict.fromkeys(zip(entities[main].tolist(), requested[main].tolist()), False))
+    return request_index
+
+
+def get_requests_from_data(df, backup_weight=BACKUP_WEIGHT):
+    # backup_weight scales the score of backup choices (scenarios.py compares alternatives)
+    selections = [s for s in list(df) if '_' in s]
+    # blank name cells as '' (read_event() already hands them over that way)
+    df = df.fillna({col: '' for col in ['entity'] + selections})
+
+    col_names = ['entity'] + selections + ['type']
+    df_requests = df[col_names].copy()
+
+    # Delete duplicate requests (one entity requesting the same other entity multiple times, or itself)
+    requested_values = df_requests[['entity'] + selections].values
+    df_long = pd.DataFrame({'row': np.repeat(np.arange(len(df_requests)), len(selections) + 1),
+                            'value': requested_values.ravel()})
+    duplicated = df_long.duplicated().values.reshape(requested_values.shape)[:, 1:]
+    df_requests[selections] = df_requests[selections].mask(duplicated, '')
+
+    main_choices_indices = [i for i, s in enumerate(list(df_requests)) if 'choice_' in s]
+    backup_choices_indices = [i for i, s in enumerate(list(df_requests)) if 'backup_' in s]
+    choice_cols = [list(df_requests)[i] for i in main_choices_indices + backup_choices_indices]
+
+    # Flatten so each request is its own row (ordered by requester, then main choices, then backups)
+    df_flat = df_requests[['entity', 'type'] + choice_cols].reset_index(drop=True)
+    df_flat['row'] = np.arange(len(df_flat))
+    df_flat = pd.melt(df_flat, id_vars=['row', 'entity', 'type'], value_vars=choice_cols,
+                      var_name='col', value_name='requested')
+    df_flat['col_order'] = np.repeat(np.arange(len(choice_cols)), len(df_requests))
+    df_flat = df_flat[df_flat['requested'] != ''].sort_values(by=['row', 'col_order'], kind='mergesort')
+
+    entity_index = build_entity_index(df)
+    reqr_codes = entity_index.index.get_indexer(df_flat['entity'])
+    reqd_codes = entity_index.index.get_indexer(df_flat['requested'])
+
+    unknown = reqd_codes == -1
+    for reqd in pd.unique(df_flat['requested'].values[unknown]):
+        logger.warning('The entity %s does not exist in the spreadsheet, so it\'s being skipped.', reqd)
+    df_flat = df_flat[~unknown]
+    reqr_codes = reqr_codes[~unknown]
+    reqd_codes = reqd_codes[~unknown]
+
+    multiplier = np.where(df_flat['col_order'].values < len(main_choices_indices), 1.0, backup_weight)
+    importance = entity_index['importance'].values
+
+    df_request_pairs = pd.DataFrame({
+        'requester': df_flat['entity'].values,
+        'requested': df_flat['requested'].values,
+        'multiplier': multiplier,
+        'reqr_type': df_flat['type'].values,
+        'reqd_type': entity_index['type'].values[reqd_codes],
+    }, columns=['requester', 'requested', 'multiplier', 'reqr_type', 'reqd_type'])
+
+    # Score for each request is multiplier * importance of requester * importance of requested
+    df_request_pairs['score'] = multiplier * importance[reqr_codes] * importance[reqd_codes]
+
+    return df_request_pairs, df_requests, len(main_choices_indices), build_request_index(df_requests)
+
+
+def clean_up_requests(df_request_pairs, entities=None):
+    # Drops same-type requests, merges mutual requests (adding their scores) and sorts by score
+    graph = RequestGraph.from_request_pairs(df_request_pairs, entities)
+
+    return graph.to_frame()
+
+
+def create_schedule(df, num_meetings):
+    df_entities = df[['entity']].drop_duplicates(subset=['entity'])
+    engine = SlotEngine(df_entities['entity'], num_meetings, index=df_entities.index)
+
+    return engine.to_schedule()
+
+
+def place_meetings(engine, group, df_requests_combined_sorted, request_index, var=None):
+    # in order of matrix, schedule meetings at the earliest slot both entities have open
+    scheduled_inds = []
+    for ind, entity1, entity2 in zip(group.index, group['entity1'].values, group['entity2'].values):
+        # all companies are entity1; inv are entity2
+        try:
+            entity1_id = engine.ids[entity1]
+            entity2_id = engine.ids[entity2]
+        except KeyError as err:
+            msg = f'Oops, looks like one or more of the numbers in {var} might be wrong. '
+            raise ValueError(str(err) + '\n' + msg)
+
+        open_col = engine.earliest_common_slot(entity1_id, entity2_id)
+        if open_col is None:
+            continue
+
+        engine.place(entity1_id, entity2_id, open_col, request_index)
+        scheduled_inds.append(ind)
+
+    df_requests_combined_sorted.loc[scheduled_inds, 'scheduled'] = True
+    metrics.inc('meetings_scheduled', len(scheduled_inds))
+    metrics.inc('meetings_unscheduled', len(group) - len(scheduled_inds))
+
+
+def split_ties(group, tied=None):
+    # pull out all matches (any non matches are moved up to the top of the list)
+    if tied is None:
+        tied = (group.duplicated(subset='entity1', keep=False) |
+                group.duplicated(subset='entity2', keep=False)).values
+    singles_inds = group.index[~tied].tolist()
+    duplicates_inds = group.index[tied].tolist()
+
+    return singles_inds, duplicates_inds
+
+
+def split_components(group, inds):
+    # connected components of the entity-overlap graph: rows sharing an entity (directly or through other rows)
+    # end up in the same component; components are independent, so their order relative to each other never matters.
+    # Union-find over integer entity codes, with union by size and full path compression
+    entities1 = group.loc[inds, 'entity1'].values
+    entities2 = group.loc[inds, 'entity2'].values
+    codes, names = pd.factorize(np.concatenate([entities1, entities2]))
+    codes1, codes2 = codes[:len(inds)].tolist(), codes[len(inds):].tolist()
+    parent = list(range(len(names)))
+    size = [1] * len(names)
+
+    def find(code):
+        root = code
+        while parent[root] != root:
+            root = parent[root]
+        while parent[code] != root:
+            parent[code], code = root, parent[code]
+        return root
+
+    for code1, code2 in zip(codes1, codes2):
+        root1, root2 = find(code1), find(code2)
+        if root1 != root2:
+            if size[root1] < size[root2]:
+                root1, root2 = root2, root1
+            parent[root2] = root1
+            size[root1] += size[root2]
+
+    components = collections.OrderedDict()
+    for ind, code1 in zip(inds, codes1):
+        components.setdefault(find(code1), []).append(ind)
+    return list(components.values())
+
+
+def drop_unschedulable(engine, group, duplicates_inds, verbose=True):
+    # delete any pairs that can't possibly match (a full schedule or no common availability)
+    schedulable_inds = []
+    entity1_ids = engine.ids_of(group.loc[duplicates_inds, 'entity1'].values).tolist()
+    entity2_ids = engine.ids_of(group.loc[duplicates_inds, 'entity2'].values).tolist()
+    free_masks = engine.free_masks
+    for ind, entity1_id, entity2_id in zip(duplicates_inds, entity1_ids, entity2_ids):
+        if free_masks[entity1_id] == 0 or free_masks[entity2_id] == 0:
+            if verbose:
+                logger.debug('%s\'s schedule is full and will be deleted', ind)
+        elif free_masks[entity1_id] & free_masks[entity2_id] == 0:
+            if verbose:
+                logger.debug('%s has no common availability and will be deleted', ind)
+        else:
+            schedulable_inds.append(ind)
+
+    # do a check to get rid of singles within duplicates_inds (caused by deleting those with no free columns)
+    _, duplicates_inds = split_ties(group.loc[schedulable_inds, :])
+    return duplicates_inds
+
+
+def fill_schedule_old(engine, df_requests_combined_sorted, request_index):
+    # includes tie-breaking
+    cursor = TieCursor.from_sorted_requests(df_requests_combined_sorted)
+
+    while not cursor.done:
+        rows = cursor.group_slice()
+        group = df_requests_combined_sorted.iloc[rows]
+        singles_inds, duplicates_inds = split_ties(group, cursor.tied[rows])
+        duplicates_inds = drop_unschedulable(engine, group, duplicates_inds)
+
+        # ask for new order
+        if len(duplicates_inds) > 0:
+            print('-----------------------------------------------')
+            print(group.loc[duplicates_inds, ['entity2', 'entity1']])
+            var = input(
+                "I need your help breaking ties! Reorder the above meeting pairs with most important mtgs "
+                "first using the row index (the first number in each row). (format: \'1,2,3\' or \'1\' or "
+                "\'1,3\') Or type \'SAME\' if it's already in the order you want. \n")
+
+            # todo try to find a way to do a separated sort by entity involved? how to order that?
+
+            try:
+                if var == 'SAME':
+                    new_order_dupl = duplicates_inds
+                else:
+                    # Change order in the original df
+                    new_order_dupl = [int(s) for s in var.split(',')]  # .strip('[]')
+            except ValueError:
+                print(f'Oops, looks like there are some formatting errors in what you typed ({var}). '
+                      f'I\'m going to exit so we can start over.')
+                sys.exit()
+        else:
+            var = None
+            new_order_dupl = duplicates_inds
+
+        new_order = singles_inds + new_order_dupl
+        try:
+            place_meetings(engine, group.reindex(new_order), df_requests_combined_sorted, request_index, var)
+        except ValueError as err:
+            print(err)
+            sys.exit()
+        cursor.advance()
+
+    return engine, df_requests_combined_sorted
+
+
+def find_ties(engine, df_requests_combined_sorted, cursor, verbose=True):
+    # the group under the cursor and its tied rows that can still be scheduled, split into independent components
+    rows = cursor.group_slice()
+    group = df_requests_combined_sorted.iloc[rows]
+
+    _, duplicates_inds = split_ties(group, cursor.tied[rows])
+    duplicates_inds_2 = drop_unschedulable(engine, group, duplicates_inds, verbose)
+    if verbose:
+        logger.debug('tied rows: %s', duplicates_inds_2)
+
+    return group, split_components(group, duplicates_inds_2)
+
+
+def offer_reorder(engine, df_requests_combined_sorted, cursor):
+    # includes tie-breaking; looks at the group under the cursor without moving it. Returns one (table, indices)
+    # string per independent cluster of tied meetings, so each can be reordered on its own
+    if cursor.done:
+        return None, None
+
+    group, components = find_ties(engine, df_requests_combined_sorted, cursor)
+
+    # ask for new order
+    if len(components) > 0:
+        # todo for the future, could also output how many slots each company has or order by company/investor name
+        ties = [str(group.loc[inds, ['entity2', 'entity1']]) for inds in components]
+        logger.debug('ties to break:\n%s', '\n\n'.join(ties))
+        return ties, [', '.join(str(ind) for ind in inds) for inds in components]
+
+    else:
+        return None, None
+
+
+def fill_schedule(engine, df_requests_combined_sorted, request_index, var, cursor, components=None, check=None):
+    # includes tie-breaking; fills the group under the cursor and moves on to the next one, then runs
+    # check(engine, group number) if given (see schedule_check.make_check)
+    rows = cursor.group_slice()
+    group = df_requests_combined_sorted.iloc[rows]
+
+    singles_inds, duplicates_inds = split_ties(group, cursor.tied[rows])
+    # the tied rows that were offered for reordering; the rest (unschedulable, or no longer tied with anything
+    # schedulable) go straight in with the singles
+    if components is None:
+        _, components = find_ties(engine, df_requests_combined_sorted, cursor, verbose=False)
+    offered = set(ind for inds in components for ind in inds)
+    leftover_inds = [ind for ind in duplicates_inds if ind not in offered]
+
+    def parse_order(text):
+        try:
+            return [int(s) for s in text.split(',')]  # .strip('[]')
+        except ValueError:
+            msg = f'Oops, looks like there are some formatting errors in what you typed ({text}). '
+            raise ValueError(msg)
+
+    if var is None or var == 'SAME':
+        new_order_dupl = [ind for ind in duplicates_inds if ind in offered]
+    elif isinstance(var, str):
+        # Change order in the original df
+        new_order_dupl = parse_order(var)
+        logger.debug('new order: %s', new_order_dupl)
+    elif all(isinstance(part, str) for part in var):
+        # one order per component (from the break_ties form); blank or 'SAME' keeps a component as it is
+        if len(var) != len(components):
+            msg = f'Oops, expected {len(components)} orders (one per group of tied meetings) but got {len(var)}. '
+            raise ValueError(msg)
+        new_order_dupl = []
+        for part, inds in zip(var, components):
+            part_order = inds if part.strip() in ('', 'SAME') else parse_order(part)
+            if not set(part_order).issubset(inds):
+                msg = f'Oops, looks like one or more of the numbers in {part} might be wrong. '
+                raise ValueError(msg)
+            new_order_dupl += part_order
+    else:
+        # already a list of row indices (from a tie-break policy)
+        new_order_dupl = list(var)
+
+    if not set(new_order_dupl).issubset(offered):
+        msg = f'Oops, looks like one or more of the numbers in {var} might be wrong. '
+        raise ValueError(msg)
+
+    # Note that offered pairs missing from the order are deleted, b/c reindexing deletes any indices not mentioned
+    new_order = singles_inds + leftover_inds + new_order_dupl
+    group = group.reindex(new_order)
+
+    with metrics.span('fill_group'):
+        place_meetings(engine, group, df_requests_combined_sorted, request_index, var)
+    metrics.inc('groups_processed')
+    cursor.advance()
+    if check is not None:
+        check(engine, cursor.position)
+
+    return engine, df_requests_combined_sorted
+
+
+def fill_until_tie(engine, df_requests_combined_sorted, request_index, cursor, progress=None, tie_policy=None,
+                   check=None):
+    # schedule score groups in order until one needs a tie-break (or every group is done); with a tie_policy the
+    # ties are ordered automatically, so this runs straight through to the end
+    while not cursor.done:
+        if tie_policy is None:
+            ties_to_break, ties_to_break_indices = offer_reorder(engine, df_requests_combined_sorted, cursor)
+            if ties_to_break is not None:
+                return ties_to_break, ties_to_break_indices
+            order = None
+            components = None
+        else:
+            # components share no entities, so each one is ordered on its own
+            group, components = find_ties(engine, df_requests_combined_sorted, cursor)
+            order = [ind for inds in components for ind in tie_policy(engine, group, inds)] if components else None
+
+        fill_schedule(engine, df_requests_combined_sorted, request_index, order, cursor, components, check)
+        logger.debug('tie_break = %s', cursor.position)
+        if progress is not None:
+            progress(cursor.position, cursor.num_groups)
+
+    return None, None
+
+
+def run_optimal_fill(engine, df_requests_combined_sorted, request_index, cursor, time_budget):
+    from optimize import solve_exact
+
+    # greedy baseline (every tie kept in sheet order) on a copy, so the report can say what the solver gained
+    greedy_engine = copy.deepcopy(engine)
+    greedy_requests = df_requests_combined_sorted.copy()
+    fill_until_tie(greedy_engine, greedy_requests, request_index, TieCursor(cursor.bounds, cursor.tied),
+                   tie_policy=same_order)
+    greedy_score = float(greedy_requests.loc[greedy_requests['scheduled'], 'score'].sum())
+
+    solved_engine = copy.deepcopy(engine)
+    solved_requests = df_requests_combined_sorted.copy()
+    report = solve_exact(solved_engine, solved_requests, request_index, time_budget)
+    report['greedy_score'] = greedy_score
+
+    # the solver can only lose to greedy when it ran out of time or N/A blocks broke its slot layout
+    if report['score'] >= greedy_score:
+        best_engine, best_requests = solved_engine, solved_requests
+        report['kept'] = 'solver'
+    else:
+        best_engine, best_requests = greedy_engine, greedy_requests
+        # the rest of the report describes the kept schedule, not the solver's
+        report['kept'] = 'greedy'
+        report['score'] = greedy_score
+        report['scheduled'] = int(greedy_requests['scheduled'].sum())
+        report['optimal'] = False
+        report['gap'] = (report['upper_bound'] - greedy_score) / report['upper_bound'] if report['upper_bound'] else 0.0
+    report['improvement'] = report['score'] - greedy_score
+    cursor.position = cursor.num_groups
+    return best_engine, best_requests, report
+
+
+def run_fair_fill(engine, df_requests_combined_sorted, request_index, cursor, min_meetings=0, max_meetings=None,
+                  fairness=1.0):
+    from fair_fill import fill_fair
+
+    # one pass over a priority queue instead of the score groups, so there are no ties to break
+    report = fill_fair(engine, df_requests_combined_sorted, request_index, min_meetings, max_meetings, fairness)
+    cursor.position = cursor.num_groups
+    return engine, df_requests_combined_sorted, report
+
+
+def apply_late_changes(state, df_unavailable=None, withdrawn=(), df_added=None):
+    from reschedule import apply_changes, index_entity_rows
+
+    # evict only what the changes touch, then give those requests (and anyone's freed slots) another go in score
+    # order; every other meeting stays where it is. New requests are scored with the upload's backup weight
+    engine = state['engine']
+    request_index = state['request_index']
+    if state.get('entity_rows') is None:
+        # built once per schedule, then kept up to date by apply_changes()
+        state['entity_rows'] = index_entity_rows(state['df_requests_combined_sorted'])
+    df_requests_combined_sorted, candidates, report = apply_changes(
+        engine, state['df_requests_combined_sorted'], request_index, state['entity_index'],
+        df_unavailable, withdrawn, df_added, state['entity_rows'], state.get('backup_weight', BACKUP_WEIGHT))
+
+    place_meetings(engine, candidates, df_requests_combined_sorted, request_index)
+    report['retried'] = len(candidates)
+    report['placed'] = int(df_requests_combined_sorted.loc[candidates.index, 'scheduled'].sum())
+
+    state['df_requests_combined_sorted'] = df_requests_combined_sorted
+    if report['rescored']:
+        # score groups only move when rows were added or rescored
+        state['cursor'] = TieCursor.from_sorted_requests(df_requests_combined_sorted)
+        state['cursor'].position = state['cursor'].num_groups
+    return report
+
+
+def check_column_names(df):
+    if not ('entity' in df.columns):
+        msg = 'There is no column labeled \'entity\'. Please fix your spreadsheet and try again.'
+        raise ValueError(msg)
+        # sys.exit()
+
+    if not ('type' in df.columns):
+        msg = 'There is no column labeled \'type\'. Please fix your spreadsheet and try again.'
+        raise ValueError(msg)
+
+    if not ('importance' in df.columns):
+        msg = 'There is no column labeled \'importance\'. Please fix your spreadsheet and try again.'
+        raise ValueError(msg)
+
+    if sum([1 for col in df.columns if 'choice' in col]) == 0:
+        msg = 'There are no meeting request columns (should be in the format \'choice_#\'). ' \
+              'Please fix your spreadsheet and try again.'
+        raise ValueError(msg)
+
+
+def _intern_names(values, names):
+    # every cell naming the same entity points at one shared string
+    codes, uniques = pd.factorize(values)
+    shared = np.array([names.setdefault(name, name) for name in uniques] + [''], dtype=object)
+    return shared[codes]  # code -1 (a blank cell) picks the trailing ''
+
+
+def _to_number(chunk, col, dtype=None):
+    # with an integer dtype, only whole numbers that fit it pass (so nothing is truncated or wrapped around)
+    values = pd.to_numeric(chunk[col], errors='coerce')
+    bad = values.isnull().values
+    kind = 'a number'
+    if dtype is not None:
+        info = np.iinfo(dtype)
+        numbers = values.values.astype(float)
+        with np.errstate(invalid='ignore'):  # blanks and inf are caught either way
+            bad = bad | (numbers % 1 != 0) | (numbers < info.min) | (numbers > info.max)
+        kind = f'a whole number from {info.min} to {info.max}'
+    if bad.any():
+        row = int(chunk.index[bad][0]) + 2  # spreadsheet row: 1-based, after the header line
+        msg = f'The \'{col}\' column should hold {kind} in every row (row {row} doesn\'t). ' \
+              'Please fix your spreadsheet and try again.'
+        raise ValueError(msg)
+    return values.values if dtype is None else values.values.astype(dtype)
+
+
+def read_event(file, chunksize=20000):
+    """Read an event spreadsheet chunk by chunk, without type inference.
+
+    Names come back as shared strings with '' for blank cells, type as int8 and importance as float32 (float64
+    when float32 would round it). The columns are checked on the first chunk, before the rest is read; rows
+    without an entity are dropped.
+    """
+    names = {}
+    chunks = []
+    name_cols = None
+    for chunk in pd.read_csv(file, dtype=object, chunksize=chunksize):
+        if name_cols is None:
+            with metrics.span('validate'):
+                check_column_names(chunk)
+            name_cols = ['entity'] + [col for col in chunk.columns if '_' in col]
+
+        chunk = chunk[chunk['entity'].notnull().values]
+        columns = collections.OrderedDict((col, chunk[col].values) for col in chunk.columns)
+        for col in name_cols:
+            columns[col] = _intern_names(chunk[col].values, names)
+        columns['type'] = _to_number(chunk, 'type', np.int8)
+        columns['importance'] = _to_number(chunk, 'importance')
+        chunks.append(pd.DataFrame(columns, columns=list(columns)))
+
+    if name_cols is None:
+        raise ValueError('The spreadsheet is empty. Please fix it and try again.')
+    df = pd.concat(chunks, ignore_index=True)
+    importance = df['importance'].values.astype(np.float32)
+    if np.array_equal(importance, df['importance'].values):
+        df['importance'] = importance
+    return df
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+class RequestGraph(object):
+    """Company <-> investor request graph in COO form, keyed by integer entity IDs.
+
+    Entry k is the pair (companies[k], investors[k]) with the summed score of both directions and whether
+    the company and/or the investor asked for the meeting. Entries are unique and ordered by (company, investor).
+    """
+
+    def __init__(self, entities, companies, investors, scores, co_req, inv_req):
+        self.entities = list(entities)
+        self.companies = companies
+        self.investors = investors
+        self.scores = scores
+        self.co_req = co_req
+        self.inv_req = inv_req
+
+    @classmethod
+    def from_request_pairs(cls, df_request_pairs, entities=None):
+        if entities is None:
+            entities = pd.unique(np.concatenate([df_request_pairs['requester'].values,
+                                                 df_request_pairs['requested'].values]))
+        entity_ids = pd.Index(entities)
+        n = len(entity_ids)
+
+        # Delete any company-company and investor-investor meetings
+        reqr_type = df_request_pairs['reqr_type'].values
+        keep = (reqr_type + df_request_pairs['reqd_type'].values) == 1
+        reqr_type = reqr_type[keep]
+        reqr = entity_ids.get_indexer(df_request_pairs['requester'].values[keep])
+        reqd = entity_ids.get_indexer(df_request_pairs['requested'].values[keep])
+        scores = df_request_pairs['score'].values[keep]
+
+        # Orient every edge company -> investor and merge both directions (add scores if both wanted to meet)
+        co_first = reqr_type == 0
+        companies = np.where(co_first, reqr, reqd).astype(np.int64)
+        investors = np.where(co_first, reqd, reqr).astype(np.int64)
+        keys, inverse = np.unique(companies * n + investors, return_inverse=True)
+        inverse = inverse.ravel()
+
+        return cls(entities,
+                   keys // n,
+                   keys % n,
+                   np.bincount(inverse, weights=scores, minlength=len(keys)),
+                   np.bincount(inverse, weights=co_first, minlength=len(keys)) > 0,
+                   np.bincount(inverse, weights=~co_first, minlength=len(keys)) > 0)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def to_csr(self):
+        """Return (indptr, investors, scores) with company c's requests at indptr[c]:indptr[c + 1]."""
+        indptr = np.zeros(len(self.entities) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.companies, minlength=len(self.entities)), out=indptr[1:])
+        return indptr, self.investors, self.scores
+
+    def score_order(self):
+        # stable, so equal scores keep the (company, investor) order
+        return np.argsort(-self.scores, kind='mergesort')
+
+    def to_frame(self):
+        """One row per company/investor pair sorted by descending score (df_requests_combined_sorted)."""
+        names = np.array(self.entities, dtype=object)
+        order = self.score_order()
+        return pd.DataFrame({
+            'entity2': names[self.investors[order]],
+            'entity1': names[self.companies[order]],
+            'score': self.scores[order],
+            'co_req': self.co_req[order],
+            'inv_req': self.inv_req[order],
+            'scheduled': False,
+        }, index=order, columns=['entity2', 'entity1', 'score', 'co_req', 'inv_req', 'scheduled'])
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+
+from slot_engine import BLOCKED
+from unavailability import apply_unavailability
+
+# Late changes to a finished schedule. Only the meetings a change touches are evicted; every other meeting stays
+# where it is. What comes back is the (score-ordered) set of requests worth another placement attempt: the evicted
+# ones, new ones, and unscheduled requests of anyone who just got a slot back.
+
+NO_ROWS = np.array([], dtype=np.int64)
+
+
+def read_added_requests(file):
+    df = pd.read_csv(file, dtype=str)
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    if 'entity' not in df.columns or 'requested' not in df.columns:
+        raise ValueError('The new requests file needs an \'entity\' and a \'requested\' column (and optionally '
+                         '\'backup\'). Please fix it and try again.')
+    if 'backup' not in df.columns:
+        df['backup'] = ''
+    df = df.dropna(subset=['entity', 'requested'])
+    df['entity'] = df['entity'].str.strip()
+    df['requested'] = df['requested'].str.strip()
+    df['backup'] = df['backup'].fillna('').str.strip().str.lower().isin(['1', 'true', 'yes', 'y', 'x'])
+    return df[['entity', 'requested', 'backup']]
+
+
+def withdraw_entities(engine, entities, label='WITHDRAWN'):
+    """Free every meeting of the withdrawn entities and block their whole row; returns the evicted pairs."""
+    evicted = []
+    entity_ids = pd.Index(engine.entities).get_indexer(list(entities))
+    for e in entity_ids[entity_ids >= 0].tolist():
+        for slot in np.flatnonzero(engine.assigned[e] >= 0).tolist():
+            partner = int(engine.assigned[e, slot])
+            engine.remove(e, partner, slot)
+            evicted.append((engine.entities[e], engine.entities[partner]))
+        open_slots = np.flatnonzero(engine.assigned[e] != BLOCKED)
+        engine.block_many(np.full(len(open_slots), e), open_slots, label)
+    unknown = [entity for entity, e in zip(entities, entity_ids) if e < 0]
+    return evicted, unknown
+
+
+def index_entity_rows(df_requests_combined_sorted):
+    """Row labels of every entity's requests (as either side), to find the rows a late change touches."""
+    labels = df_requests_combined_sorted.index.values
+    codes, names = pd.factorize(np.concatenate([df_requests_combined_sorted['entity1'].values,
+                                                df_requests_combined_sorted['entity2'].values]))
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(names)))[:-1]
+    return dict(zip(names, np.split(np.concatenate([labels, labels])[order], bounds)))
+
+
+def _entity_rows(entity_rows, entities):
+    return np.concatenate([entity_rows.get(entity, NO_ROWS) for entity in entities]) if entities else NO_ROWS
+
+
+def _pair_rows(entity_rows, pairs):
+    # one request row per (company, investor) pair, whichever way round the pair is given
+    return np.concatenate([np.intersect1d(entity_rows.get(a, NO_ROWS), entity_rows.get(b, NO_ROWS))
+                           for a, b in pairs]) if pairs else NO_ROWS
+
+
+def _insert_sorted(rows, moved):
+    # put the rows at positions `moved` (rescored or new) back in score order without re-sorting the whole list;
+    # the result is what a stable sort by score would give
+    neg_scores = -rows['score'].values
+    moved = moved[np.lexsort((moved, neg_scores[moved]))]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[moved] = False
+    kept = np.flatnonzero(keep)
+    kept_scores = neg_scores[kept]
+    points = []
+    for position in moved.tolist():
+        lo = np.searchsorted(kept_scores, neg_scores[position], side='left')
+        hi = np.searchsorted(kept_scores, neg_scores[position], side='right')
+        points.append(lo + np.searchsorted(kept[lo:hi], position))
+    return rows.take(np.insert(kept, points, moved))
+
+
+def add_requests(df_requests_combined_sorted, request_index, entity_index, df_added, entity_rows,
+                 backup_weight=0.5):
+    """Merge new (entity, requested, backup) rows into the request list the same way the upload scores them.
+
+    Only the rows of the pairs involved are updated; new and rescored rows are moved into score order and the
+    new rows' labels are added to entity_rows. Returns the updated request list, the entities whose requests
+    changed, the requests that were skipped and the number of rows added or rescored.
+    """
+    requesters = entity_index.index.get_indexer(df_added['entity'].values)
+    requested = entity_index.index.get_indexer(df_added['requested'].values)
+    types = entity_index['type'].values
+    importance = entity_index['importance'].values
+
+    known = (requesters >= 0) & (requested >= 0)
+    valid = known.copy()
+    valid[known] = (types[requesters[known]] + types[requested[known]]) == 1
+    skipped = [(entity, other) for entity, other in
+               zip(df_added['entity'].values[~valid], df_added['requested'].values[~valid])]
+
+    rows = df_requests_combined_sorted
+    next_index = int(rows.index.max()) + 1 if len(rows) else 0
+    updates = {}  # row label -> [score to add, co_req, inv_req], for existing and new rows alike
+    new_rows = {}  # (company, investor) -> label of a row this call adds
+    changed = set()
+
+    for reqr, reqd, is_backup in zip(requesters[valid], requested[valid], df_added['backup'].values[valid]):
+        requester, other = entity_index.index[reqr], entity_index.index[reqd]
+        if request_index.get((requester, other)) is False or \
+                (request_index.get((requester, other)) is True and is_backup):
+            continue  # already asked for, at least as strongly
+        upgrade = request_index.get((requester, other)) is True
+        request_index[(requester, other)] = bool(is_backup)
+
+        score = (backup_weight if is_backup else 1.0) * importance[reqr] * importance[reqd]
+        if upgrade:
+            score -= backup_weight * importance[reqr] * importance[reqd]
+        is_company = bool(types[reqr] == 0)
+        key = (requester, other) if is_company else (other, requester)
+        changed.update(key)
+
+        label = new_rows.get(key)
+        if label is None:
+            existing = _pair_rows(entity_rows, [key])
+            if len(existing):
+                label = int(existing[0])
+            else:
+                label = new_rows[key] = next_index
+                next_index += 1
+        update = updates.setdefault(label, [0.0, False, False])
+        update[0] += score
+        update[1] |= is_company
+        update[2] |= not is_company
+
+    if not updates:
+        return rows, changed, skipped, 0
+
+    if new_rows:
+        df_new = pd.DataFrame({'entity2': [key[1] for key in new_rows], 'entity1': [key[0] for key in new_rows],
+                               'score': 0.0, 'co_req': False, 'inv_req': False, 'scheduled': False},
+                              index=list(new_rows.values()), columns=rows.columns)
+        rows = pd.concat([rows, df_new])
+        for (company, investor), label in new_rows.items():
+            for entity in (company, investor):
+                entity_rows[entity] = np.append(entity_rows.get(entity, NO_ROWS), label)
+
+    positions = rows.index.get_indexer(list(updates))
+    scores, co_req, inv_req = (np.array(values) for values in zip(*updates.values()))
+    rows.iloc[positions, rows.columns.get_loc('score')] = rows['score'].values[positions] + scores
+    rows.iloc[positions, rows.columns.get_loc('co_req')] = rows['co_req'].values[positions].astype(bool) | co_req
+    rows.iloc[positions, rows.columns.get_loc('inv_req')] = rows['inv_req'].values[positions].astype(bool) | inv_req
+    return _insert_sorted(rows, positions), changed, skipped, len(positions)
+
+
+def apply_changes(engine, df_requests_combined_sorted, request_index, entity_index,
+                  df_unavailable=None, withdrawn=(), df_added=None, entity_rows=None, backup_weight=0.5):
+    """Apply late changes to a finished schedule; returns (request list, candidates, report).
+
+    candidates is the part of the request list to run through place_meetings() again, in score order. Rows are
+    found through entity_rows (see index_entity_rows(), built here if not given) and updated in place.
+    """
+    if entity_rows is None:
+        entity_rows = index_entity_rows(df_requests_combined_sorted)
+    report = {'evicted': 0, 'rescored': 0, 'unknown_entities': [], 'bad_meetings': [], 'skipped_requests': []}
+    evicted = []
+
+    withdrawn_evicted, unknown = withdraw_entities(engine, withdrawn)
+    evicted += withdrawn_evicted
+    report['unknown_entities'] += unknown
+
+    if df_unavailable is not None:
+        unavailability_report = apply_unavailability(engine, df_unavailable, evict=True)
+        evicted += unavailability_report['evicted']
+        report['unknown_entities'] += unavailability_report['unknown_entities']
+        report['bad_meetings'] += unavailability_report['bad_meetings']
+
+    touched = set(entity for pair in evicted for entity in pair)
+    if df_added is not None and len(df_added):
+        df_requests_combined_sorted, changed, skipped, report['rescored'] = add_requests(
+            df_requests_combined_sorted, request_index, entity_index, df_added, entity_rows, backup_weight)
+        touched |= changed
+        report['skipped_requests'] = skipped
+
+    scheduled_col = df_requests_combined_sorted.columns.get_loc('scheduled')
+    if evicted:
+        evicted_rows = df_requests_combined_sorted.index.get_indexer(_pair_rows(entity_rows, evicted))
+        df_requests_combined_sorted.iloc[evicted_rows, scheduled_col] = False
+    report['evicted'] = len(evicted)
+
+    # the touched entities' unscheduled requests, in list (score) order
+    positions = np.unique(df_requests_combined_sorted.index.get_indexer(_entity_rows(entity_rows, list(touched))))
+    positions = positions[~df_requests_combined_sorted['scheduled'].values[positions].astype(bool)]
+    return df_requests_combined_sorted, df_requests_combined_sorted.iloc[positions], report
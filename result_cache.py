@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Memoized pipeline results on local disk. Keys chain: the upload is keyed on the spreadsheet's bytes, the first
+# fill on that plus the schedule/unavailability files and settings, and every later fill on the previous key plus
+# the tie-break order typed in. A replay that keeps giving the same answers hits at every step; once it diverges
+# it carries on from the state after the last matching step. Bump CACHE_VERSION whenever a cached object's
+# layout changes, so old pickles are never loaded.
+
+CACHE_VERSION = 1
+
+
+def content_key(*parts):
+    """sha256 over parts: bytes as they are, everything else as JSON."""
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for part in parts:
+        data = part if isinstance(part, bytes) else json.dumps(part, sort_keys=True).encode()
+        # length prefix, so ('ab', 'c') and ('a', 'bc') don't collide
+        digest.update(str(len(data)).encode() + b':' + data)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """One pickle per key (folder/<key>.pkl); least recently used entries go once the folder passes max_bytes."""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.folder, key + '.pkl')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # the mtime is the entry's last use
+            os.utime(path, None)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another worker evicted it first
+            total -= size
+
+
+def make_result_cache(folder, max_mb):
+    return ResultCache(folder, max_mb * 1024 * 1024) if max_mb > 0 else None
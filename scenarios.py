@@ -0,0 +1,163 @@
+import argparse
+import concurrent.futures
+import copy
+import itertools
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline import build_entity_index, check_column_names, clean_up_requests, create_schedule, fill_until_tie, \
+    get_requests_from_data, read_event
+from slot_engine import SlotEngine
+from tie_cursor import TieCursor
+from tie_policies import TIE_POLICIES, get_tie_policy
+from unavailability import apply_unavailability, read_unavailability
+
+# What-if runs: the same event scheduled under different scoring (backup weight, importance transform) and
+# tie-break policies, compared side by side, e.g.
+#   python scenarios.py event.csv --backup-weights 0.25 0.5 --importance identity sqrt --tie-policies same mutual_first
+# The event is parsed once; workers get it by fork and only re-score, sort and fill. Every scenario's schedule is
+# also scored the default way (backups 0.5, importance as is) in base_score, so the rows compare like for like.
+
+IMPORTANCE_TRANSFORMS = {
+    'identity': lambda importance: importance,
+    'square': np.square,
+    'sqrt': np.sqrt,
+    'log1p': np.log1p,
+    'flat': np.ones_like,
+}
+
+# set by run_scenarios() just before the pool forks, so workers share the parsed event instead of unpickling it
+_shared_event = None
+
+
+def prepare_event(df_event, df_schedule=None, df_unavailable=None):
+    """Everything the scenarios share: parsed requests and the engine with unavailability applied."""
+    check_column_names(df_event)
+    df_request_pairs, df_requests, num_meetings, request_index = get_requests_from_data(df_event)
+    entity_index = build_entity_index(df_event)
+
+    if df_schedule is None:
+        df_schedule = create_schedule(df_event, num_meetings)
+    engine = SlotEngine.from_schedule(df_schedule.replace(np.nan, ''))
+    if df_unavailable is not None:
+        apply_unavailability(engine, df_unavailable)
+    engine.mark_requests(request_index)
+
+    base = clean_up_requests(df_request_pairs, entity_index.index)
+    return {
+        'entity_index': entity_index,
+        'df_request_pairs': df_request_pairs,
+        'request_index': request_index,
+        'engine': engine,
+        'base_pairs': pd.MultiIndex.from_arrays([base['entity1'].values, base['entity2'].values]),
+        'base_scores': base['score'].values,
+    }
+
+
+def scenario_grid(backup_weights=(0.5,), importance_transforms=('identity',), tie_policies=('same',), tie_seed=0):
+    """Every combination of the given parameters, as a list of scenario dicts."""
+    return [{'backup_weight': weight, 'importance': transform, 'tie_policy': policy, 'tie_seed': tie_seed}
+            for weight, transform, policy in itertools.product(backup_weights, importance_transforms, tie_policies)]
+
+
+def rescore(event, backup_weight, importance_transform):
+    df_request_pairs = event['df_request_pairs']
+    entity_index = event['entity_index']
+    if importance_transform not in IMPORTANCE_TRANSFORMS:
+        raise ValueError(f'Unknown importance transform \'{importance_transform}\' '
+                         f'(expected one of {", ".join(IMPORTANCE_TRANSFORMS)}).')
+
+    importance = IMPORTANCE_TRANSFORMS[importance_transform](entity_index['importance'].values.astype(float))
+    reqr = entity_index.index.get_indexer(df_request_pairs['requester'].values)
+    reqd = entity_index.index.get_indexer(df_request_pairs['requested'].values)
+    # the event was parsed with main choices at 1.0 and backups at the default weight
+    multiplier = np.where(df_request_pairs['multiplier'].values == 1.0, 1.0, backup_weight)
+    return df_request_pairs.assign(multiplier=multiplier, score=multiplier * importance[reqr] * importance[reqd])
+
+
+def run_scenario(event, scenario):
+    """Schedule one scenario on a copy of the prepared event; returns its row of the comparison table."""
+    start = time.perf_counter()
+    df_request_pairs = rescore(event, scenario.get('backup_weight', 0.5), scenario.get('importance', 'identity'))
+    df_requests_combined_sorted = clean_up_requests(df_request_pairs, event['entity_index'].index)
+    engine = copy.deepcopy(event['engine'])
+    cursor = TieCursor.from_sorted_requests(df_requests_combined_sorted)
+    policy = get_tie_policy(scenario.get('tie_policy', 'same'), scenario.get('tie_seed', 0))
+    if policy is None:
+        raise ValueError('Scenarios need an automatic tie-break policy.')
+    fill_until_tie(engine, df_requests_combined_sorted, event['request_index'], cursor, tie_policy=policy)
+
+    scheduled = df_requests_combined_sorted['scheduled'].values
+    pairs = df_requests_combined_sorted[scheduled]
+    base_rows = event['base_pairs'].get_indexer(list(zip(pairs['entity1'].values, pairs['entity2'].values)))
+
+    # share of each entity's requested meetings that made it in, over entities that requested (or were requested)
+    entities = np.concatenate([df_requests_combined_sorted['entity1'].values,
+                               df_requests_combined_sorted['entity2'].values])
+    met = pd.Series(np.tile(scheduled, 2)).groupby(entities).mean()
+
+    return dict(scenario, **{
+        'score': float(df_requests_combined_sorted['score'].values[scheduled].sum()),
+        'base_score': float(event['base_scores'][base_rows[base_rows >= 0]].sum()),
+        'requests_met': int(scheduled.sum()),
+        'met_share_mean': float(met.mean()) if len(met) else 0.0,
+        'met_share_min': float(met.min()) if len(met) else 0.0,
+        'met_share_std': float(met.std(ddof=0)) if len(met) else 0.0,
+        'entities_without_meetings': int((met == 0).sum()),
+        'seconds': time.perf_counter() - start,
+    })
+
+
+def _run_shared(scenario):
+    return run_scenario(_shared_event, scenario)
+
+
+def run_scenarios(event, scenarios, workers=None):
+    """Run every scenario on a prepared event (see prepare_event) in a process pool; returns a DataFrame."""
+    global _shared_event
+    if workers == 1 or len(scenarios) <= 1:
+        rows = [run_scenario(event, scenario) for scenario in scenarios]
+    elif multiprocessing.get_start_method() == 'fork':
+        _shared_event = event
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                rows = list(executor.map(_run_shared, scenarios))
+        finally:
+            _shared_event = None
+    else:
+        # no fork (Windows, macOS): every task carries its own copy of the event
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(run_scenario, itertools.repeat(event), scenarios))
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare scoring parameters and tie policies on one event.')
+    parser.add_argument('event', help='event CSV')
+    parser.add_argument('--schedule', help='the schedule CSV with N/A cells, as given to the unavailability page')
+    parser.add_argument('--unavailability', help='bulk (entity, meeting) unavailability CSV')
+    parser.add_argument('--backup-weights', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--importance', nargs='+', default=['identity'], choices=sorted(IMPORTANCE_TRANSFORMS))
+    parser.add_argument('--tie-policies', nargs='+', default=['same'], choices=sorted(TIE_POLICIES))
+    parser.add_argument('--tie-seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--output', help='write the comparison table as CSV here instead of printing it')
+    args = parser.parse_args(argv)
+
+    event = prepare_event(read_event(args.event),
+                          pd.read_csv(args.schedule, index_col=0) if args.schedule else None,
+                          read_unavailability(args.unavailability) if args.unavailability else None)
+    table = run_scenarios(event, scenario_grid(args.backup_weights, args.importance, args.tie_policies,
+                                               args.tie_seed), args.jobs)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    else:
+        print(table.to_string(index=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
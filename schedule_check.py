@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import sys
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from pipeline import build_entity_index, read_event
+from slot_engine import BLOCKED, SlotEngine
+
+# Consistency checks on a schedule, all with whole-array operations on the engine's (entity x slot) matrix, so
+# they're cheap enough to run after every fill step. A schedule file can be checked on its own too:
+#   python schedule_check.py df_schedule.csv --event event.csv     # --event adds the same-type check
+# Every problem is reported as (entity, meeting number, other entity) rows.
+
+PROBLEMS = [
+    ('asymmetric', 'listed as a meeting on one side only'),
+    ('double_booked', 'booked with more than one entity in the same meeting'),
+    ('on_blocked', 'meetings on N/A slots'),
+    ('same_type', 'meetings between two companies or two investors'),
+    ('self_meetings', 'entities meeting themselves'),
+    ('repeated', 'pairs meeting more than once'),
+]
+
+
+def entity_types(engine, entity_index):
+    """Each engine entity's type (NaN for names the spreadsheet doesn't have), for the same-type check."""
+    return entity_index['type'].reindex(engine.entities).values
+
+
+def _rows(engine, entity_ids, slots, others):
+    names = engine.entities
+    return [(names[e], s + 1, names[o]) for e, s, o in zip(entity_ids.tolist(), slots.tolist(), others.tolist())]
+
+
+def check_schedule(engine, types=None):
+    """Report every broken invariant in the engine's schedule; report['ok'] is True when there are none."""
+    assigned = engine.assigned
+    num_entities, num_slots = assigned.shape
+    entity_ids, slots = np.nonzero(assigned >= 0)
+    partners = assigned[entity_ids, slots].astype(np.int64)
+    back = assigned[partners, slots]
+
+    # a meeting shows up in both rows, in the same slot
+    on_blocked = back == BLOCKED
+    asymmetric = (back != entity_ids) & ~on_blocked
+    # two entities listing the same partner in the same slot
+    cell_keys = partners * num_slots + slots
+    double_booked = np.bincount(cell_keys, minlength=num_entities * num_slots)[cell_keys] > 1
+    self_meetings = partners == entity_ids
+
+    # each pair once from here on (the lower ID's side)
+    pair = entity_ids < partners
+    same_type = np.zeros(len(partners), dtype=bool)
+    if types is not None:
+        types = pd.Series(types).values
+        known = pd.notnull(types[entity_ids]) & pd.notnull(types[partners])
+        same_type = pair & known & (types[entity_ids] == types[partners])
+    pair_keys = entity_ids[pair] * num_entities + partners[pair]
+    _, first = np.unique(pair_keys, return_index=True)
+    repeated = np.zeros(len(partners), dtype=bool)
+    repeated[np.flatnonzero(pair)] = True
+    repeated[np.flatnonzero(pair)[first]] = False
+
+    # meetings written over a cell that was N/A
+    blocked_cells = np.fromiter(itertools.chain.from_iterable(engine.blocked_labels), dtype=np.int64,
+                                count=2 * len(engine.blocked_labels)).reshape(-1, 2)
+    overwritten = blocked_cells[assigned[blocked_cells[:, 0], blocked_cells[:, 1]] >= 0]
+
+    report = {
+        'asymmetric': _rows(engine, entity_ids[asymmetric], slots[asymmetric], partners[asymmetric]),
+        'double_booked': _rows(engine, partners[double_booked], slots[double_booked], entity_ids[double_booked]),
+        'on_blocked': _rows(engine, partners[on_blocked], slots[on_blocked], entity_ids[on_blocked]) +
+        _rows(engine, overwritten[:, 0], overwritten[:, 1], assigned[overwritten[:, 0], overwritten[:, 1]]),
+        'same_type': _rows(engine, entity_ids[same_type], slots[same_type], partners[same_type]),
+        'self_meetings': _rows(engine, entity_ids[self_meetings], slots[self_meetings], partners[self_meetings]),
+        'repeated': _rows(engine, entity_ids[repeated], slots[repeated], partners[repeated]),
+        'stale_free_masks': [engine.entities[e] for e in engine.stale_free_masks()],
+    }
+    report['ok'] = not any(report[key] for key in report)
+    return report
+
+
+def describe_problems(report, limit=5):
+    """Organizer-facing summary of check_schedule()'s report (a few examples per problem), or None if it's ok."""
+    problems = []
+    for key, description in PROBLEMS:
+        rows = report[key]
+        if rows:
+            examples = ', '.join(f'{entity} mtg{meeting} ({other})' for entity, meeting, other in rows[:limit])
+            more = f' and {len(rows) - limit} more' if len(rows) > limit else ''
+            problems.append(f'{description}: {examples}{more}')
+    if report['stale_free_masks']:
+        problems.append('open slots out of date for: ' + ', '.join(report['stale_free_masks'][:limit]))
+    if not problems:
+        return None
+    return 'The schedule doesn\'t add up. ' + '; '.join(problems) + '.'
+
+
+def make_check(types=None):
+    """A check(engine, step) for the fill loop: raises ValueError as soon as a fill step leaves a broken schedule."""
+    def check(engine, step):
+        with metrics.span('check_schedule'):
+            report = check_schedule(engine, types)
+        if not report['ok']:
+            raise ValueError(f'After score group {step}: ' + describe_problems(report))
+    return check
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check a schedule CSV for inconsistent meetings.')
+    parser.add_argument('schedule', help='a df_schedule.csv, e.g. the one typed into for the unavailability page')
+    parser.add_argument('--event', help='the event spreadsheet, to also flag same-type meetings')
+    parser.add_argument('--limit', type=int, default=5, help='examples to print per problem')
+    args = parser.parse_args(argv)
+
+    # read the way the unavailability page does
+    engine = SlotEngine.from_schedule(pd.read_csv(args.schedule, index_col=0).replace(np.nan, ''))
+    types = None
+    if args.event:
+        types = entity_types(engine, build_entity_index(read_event(args.event)))
+
+    report = check_schedule(engine, types)
+    print(describe_problems(report, args.limit) or 'The schedule is consistent.', file=sys.stderr)
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+FREE = -1
+BLOCKED = -2
+
+# request_kind values: did the entity in this row ask for the meeting, and as a main choice or a backup
+NOT_REQUESTED = 0
+CHOICE = 1
+BACKUP = 2
+
+
+class SlotEngine(object):
+    """Array-backed schedule: one row per entity (integer ID), one column per meeting slot.
+
+    assigned[e, s] holds the ID of the entity that e meets in slot s, FREE or BLOCKED (e.g. 'N/A' cells), and
+    request_kind[e, s] whether e requested that meeting (NOT_REQUESTED, CHOICE or BACKUP).
+    free_masks[e] is a bitmask of e's open slots (bit s set = slot s is open), so the earliest common slot
+    of two entities is the lowest set bit of free_masks[a] & free_masks[b].
+    """
+
+    def __init__(self, entities, num_meetings, index=None):
+        self.entities = list(entities)
+        self.ids = {entity: i for i, entity in enumerate(self.entities)}
+        self.num_meetings = num_meetings
+        self.index = pd.RangeIndex(len(self.entities)) if index is None else index
+
+        self.assigned = np.full((len(self.entities), num_meetings), FREE, dtype=np.int32)
+        self.request_kind = np.zeros((len(self.entities), num_meetings), dtype=np.int8)
+        self.blocked_labels = {}  # (entity ID, slot) -> original cell text for blocked slots
+        self.free_masks = [(1 << num_meetings) - 1] * len(self.entities)
+
+    @classmethod
+    def from_schedule(cls, df_schedule):
+        """Build an engine from a df_schedule frame (entity, mtg1, mtg1_req, mtg2, ...)."""
+        num_meetings = sum(1 for col in df_schedule.columns if col.startswith('mtg') and not col.endswith('_req'))
+        engine = cls(df_schedule['entity'].tolist(), num_meetings, index=df_schedule.index)
+
+        mtg_cols = ['mtg' + str(ind) for ind in range(1, num_meetings + 1)]
+        cells = df_schedule[mtg_cols].fillna('').values.astype(object)
+        codes = pd.Index(engine.entities).get_indexer(cells.ravel()).reshape(cells.shape)
+        taken = cells != ''
+
+        # Cells naming a known entity are meetings; anything else non-empty (N/A, UNAVAILABLE...) is a block
+        engine.assigned[taken & (codes >= 0)] = codes[taken & (codes >= 0)]
+        for e, s in zip(*np.nonzero(taken & (codes < 0))):
+            engine.assigned[e, s] = BLOCKED
+            engine.blocked_labels[(int(e), int(s))] = cells[e, s]
+
+        req_cols = [col + '_req' for col in mtg_cols]
+        if all(col in df_schedule.columns for col in req_cols):
+            # the CSV only says requested or not; mark_requests() recovers which ones were backups
+            flags = df_schedule[req_cols].astype(str).values == 'True'
+            engine.request_kind[flags & (engine.assigned >= 0)] = CHOICE
+
+        engine.free_masks = _to_masks(engine.assigned == FREE)
+        return engine
+
+    @property
+    def requested(self):
+        return self.request_kind != NOT_REQUESTED
+
+    def mark_requests(self, request_index):
+        """Set request_kind for every placed meeting from a (requester, requested) -> is_backup index."""
+        for e, s in zip(*np.nonzero(self.assigned >= 0)):
+            self.request_kind[e, s] = lookup_request_kind(
+                request_index, self.entities[e], self.entities[self.assigned[e, s]])
+
+    def block(self, entity_id, slot, label='N/A'):
+        self.assigned[entity_id, slot] = BLOCKED
+        self.blocked_labels[(entity_id, slot)] = label
+        self.free_masks[entity_id] &= ~(1 << slot)
+
+    def block_many(self, entity_ids, slots, label='N/A'):
+        """Block many (entity ID, slot) cells at once; cells holding a meeting are left alone.
+
+        Returns a boolean array over the inputs marking the cells that already had a meeting.
+        """
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        slots = np.asarray(slots, dtype=np.int64)
+        booked = self.assigned[entity_ids, slots] >= 0
+        entity_ids, slots = entity_ids[~booked], slots[~booked]
+
+        self.assigned[entity_ids, slots] = BLOCKED
+        self.blocked_labels.update(dict.fromkeys(zip(entity_ids.tolist(), slots.tolist()), label))
+        touched = np.unique(entity_ids)
+        for e, mask in zip(touched.tolist(), _to_masks(self.assigned[touched] == FREE)):
+            self.free_masks[e] = mask
+        return booked
+
+    def ids_of(self, names):
+        """Integer IDs for an array of entity names (-1 for names the schedule doesn't have)."""
+        # entities never change after the engine is built, so the lookup index is made once
+        if getattr(self, '_name_index', None) is None:
+            self._name_index = pd.Index(self.entities)
+        return self._name_index.get_indexer(names)
+
+    def common_free(self, entity1_id, entity2_id):
+        return self.free_masks[entity1_id] & self.free_masks[entity2_id]
+
+    def earliest_common_slot(self, entity1_id, entity2_id):
+        """Return the first slot both entities have open, or None."""
+        mask = self.free_masks[entity1_id] & self.free_masks[entity2_id]
+        if mask == 0:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+    def place(self, entity1_id, entity2_id, slot, request_index=None):
+        self.assigned[entity1_id, slot] = entity2_id
+        self.assigned[entity2_id, slot] = entity1_id
+        if request_index is not None:
+            entity1, entity2 = self.entities[entity1_id], self.entities[entity2_id]
+            self.request_kind[entity1_id, slot] = lookup_request_kind(request_index, entity1, entity2)
+            self.request_kind[entity2_id, slot] = lookup_request_kind(request_index, entity2, entity1)
+        self.free_masks[entity1_id] &= ~(1 << slot)
+        self.free_masks[entity2_id] &= ~(1 << slot)
+
+    def remove(self, entity1_id, entity2_id, slot):
+        self.assigned[entity1_id, slot] = FREE
+        self.assigned[entity2_id, slot] = FREE
+        self.request_kind[entity1_id, slot] = NOT_REQUESTED
+        self.request_kind[entity2_id, slot] = NOT_REQUESTED
+        self.free_masks[entity1_id] |= 1 << slot
+        self.free_masks[entity2_id] |= 1 << slot
+
+    def stale_free_masks(self):
+        """IDs of the entities whose free_masks entry doesn't match their FREE cells (always none, unless a bug)."""
+        open_slots = self.assigned == FREE
+        if self.num_meetings < 63:
+            # compared as int64 arrays; the matrix product is _to_masks() without the conversion to Python ints
+            weights = np.left_shift(1, np.arange(self.num_meetings, dtype=np.int64))
+            kept = np.array(self.free_masks, dtype=np.int64)
+            return np.flatnonzero(open_slots.astype(np.int64).dot(weights) != kept).tolist()
+        return [e for e, (mask, kept) in enumerate(zip(_to_masks(open_slots), self.free_masks)) if mask != kept]
+
+    def to_schedule(self):
+        """Export to the df_schedule layout used for the CSV downloads."""
+        # FREE (-1) indexes the trailing '' so free slots come out blank
+        names = np.array(self.entities + [''], dtype=object)
+        cells = names[np.where(self.assigned == BLOCKED, FREE, self.assigned)]
+        for (e, s), label in self.blocked_labels.items():
+            cells[e, s] = label
+
+        df_schedule = pd.DataFrame({'entity': self.entities}, index=self.index)
+        for ind in range(1, self.num_meetings + 1):
+            df_schedule['mtg' + str(ind)] = cells[:, ind - 1]
+            # mtg#_req represents if that person requested that meeting or not
+            df_schedule['mtg' + str(ind) + '_req'] = self.request_kind[:, ind - 1] != NOT_REQUESTED
+
+        return df_schedule
+
+
+def lookup_request_kind(request_index, requester, requested):
+    is_backup = request_index.get((requester, requested))
+    if is_backup is None:
+        return NOT_REQUESTED
+    return BACKUP if is_backup else CHOICE
+
+
+def _to_masks(open_slots):
+    # one bitmask per row of a boolean (entity x slot) array; a single matrix product while the masks fit in int64
+    if open_slots.shape[1] < 63:
+        weights = np.left_shift(1, np.arange(open_slots.shape[1], dtype=np.int64))
+        return [int(mask) for mask in open_slots.astype(np.int64).dot(weights)]
+    return [_to_mask(row) for row in open_slots]
+
+
+def _to_mask(open_slots):
+    mask = 0
+    for slot in np.flatnonzero(open_slots):
+        mask |= 1 << int(slot)
+    return mask
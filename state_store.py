@@ -0,0 +1,77 @@
+import collections
+import os
+import pickle
+import tempfile
+import threading
+
+
+class MemoryStateStore(object):
+    """In-process LRU of pickled scheduling states; only for a single worker process."""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._states = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            data = self._states.get(key)
+            if data is None:
+                return None
+            self._states.move_to_end(key)
+        # every load gets its own copy, so a half-finished request never leaks into the stored state
+        return pickle.loads(data)
+
+    def save(self, key, state):
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._states[key] = data
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+
+class DiskStateStore(object):
+    """One pickle file per state (folder/<key>/state.pkl), so several gunicorn workers can serve the same session."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, key):
+        return os.path.join(self.folder, key, 'state.pkl')
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, state):
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # write then rename so readers in other workers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def make_state_store(backend, folder):
+    if backend == 'memory':
+        return MemoryStateStore()
+    if backend == 'disk':
+        return DiskStateStore(folder)
+    raise ValueError(f'Unknown state backend \'{backend}\' (expected \'memory\' or \'disk\').')
@@ -2,41 +2,51 @@
  Created on : Jul 4, 2017, 12:43:10 AM
  Author     : Atta-Ur-Rehman Shah (http://attacomsian.com)
 
- edited by Minna in certain places
+ edited by Minna in certain places; no jQuery/WOW/Bootstrap JS any more, so the pages work without the CDNs
  */
-$(function() {
+document.addEventListener('DOMContentLoaded', function() {
 
-  //init wow effects
-  new WOW().init();
+  // wow effects: .wow elements play their animate.css animation when they scroll into view
+  var wows = document.querySelectorAll('.wow');
+  if ('IntersectionObserver' in window) {
+    var observer = new IntersectionObserver(function(entries) {
+      entries.forEach(function(entry) {
+        if (entry.isIntersecting) {
+          entry.target.style.visibility = '';
+          entry.target.classList.add('animated');
+          observer.unobserve(entry.target);
+        }
+      });
+    });
+    Array.prototype.forEach.call(wows, function(el) {
+      el.style.visibility = 'hidden';
+      observer.observe(el);
+    });
+  } else {
+    Array.prototype.forEach.call(wows, function(el) {
+      el.classList.add('animated');
+    });
+  }
 
-  //scroll menu
-  // $(window).scroll(function() {
-  //   var secondFeature = $('#features').offset().top;
-  //   var scroll = $(window).scrollTop();
-  //   if (scroll >= 300) {
-  //     $('.sticky-navigation').css({
-  //       "top": '0px'
-  //     });
-  //   } else {
-  //     $('.sticky-navigation').css({
-  //       "top": '-100px'
-  //     });
-  //   }
-  //   if (scroll >= secondFeature - 200) {
-  //     $(".mobileScreen").css({
-  //       'background-position': 'center top'
-  //     });
-  //   }
-  //   return false;
-  // });
+  // page scroll
+  Array.prototype.forEach.call(document.querySelectorAll('a.page-scroll'), function(link) {
+    link.addEventListener('click', function(event) {
+      var target = document.querySelector(link.getAttribute('href'));
+      if (target) {
+        window.scrollTo({top: target.getBoundingClientRect().top + window.pageYOffset - 20, behavior: 'smooth'});
+        event.preventDefault();
+      }
+    });
+  });
 
-  //page scroll
-  $('a.page-scroll').bind('click', function(event) {
-    var $anchor = $(this);
-    $('html, body').stop().animate({
-      scrollTop: $($anchor.attr('href')).offset().top - 20
-    }, 1500, 'easeInOutExpo');
-    event.preventDefault();
+  // navbar toggler (what Bootstrap's collapse plugin did)
+  Array.prototype.forEach.call(document.querySelectorAll('[data-toggle="collapse"]'), function(button) {
+    button.addEventListener('click', function() {
+      var target = document.querySelector(button.getAttribute('data-target'));
+      if (target) {
+        target.classList.toggle('show');
+      }
+    });
   });
 
   // accordion - Added by Minna
@@ -45,8 +55,8 @@ $(function() {
 
   for (i = 0; i < acc.length; i++) {
     acc[i].addEventListener("click", function() {
-      for (j = 0; j < acc.length; j++) {
-        if (j != i) {
+      for (var j = 0; j < acc.length; j++) {
+        if (acc[j] !== this) {
           acc[j].classList.toggle("active", false);
           acc[j].nextElementSibling.style.maxHeight = null;
         }
@@ -63,11 +73,4 @@ $(function() {
     });
   }
 
-
-  function setClass(els, className, fnName) {
-    for (var i = 0; i < els.length; i++) {
-      els[i].classList[fnName](className);
-    }
-  }
-
 });
@@ -0,0 +1,91 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Seeded generator for event spreadsheets in the upload format (entity, choice_#, backup_#, type, importance), plus
+# a matching unavailability list in the bulk (entity, meeting) format.
+
+DEFAULT_IMPORTANCE = {1: 0.5, 2: 0.3, 3: 0.2}
+
+
+def generate_event(num_companies=60, num_investors=30, num_choices=5, num_backups=2, importance=None,
+                   skew=1.0, fill_rate=0.9, seed=0):
+    """Return an event DataFrame.
+
+    importance maps importance value -> probability. skew is the Zipf exponent of how popular targets are (0 means
+    everyone is equally likely to be picked); fill_rate is the chance each choice/backup cell is filled in.
+    """
+    rng = np.random.RandomState(seed)
+    importance = DEFAULT_IMPORTANCE if importance is None else importance
+    values = np.array(list(importance.keys()))
+    weights = np.array(list(importance.values()), dtype=float)
+
+    companies = ['Company %0*d' % (len(str(num_companies)), i + 1) for i in range(num_companies)]
+    investors = ['Investor %0*d' % (len(str(num_investors)), i + 1) for i in range(num_investors)]
+    num_picks = num_choices + num_backups
+
+    rows = []
+    for names, others, entity_type in ((companies, investors, 0), (investors, companies, 1)):
+        # the same few targets are popular with everyone: a shuffled Zipf ranking per side
+        popularity = 1.0 / np.arange(1, len(others) + 1) ** skew
+        popularity = popularity[rng.permutation(len(others))]
+        popularity /= popularity.sum()
+        picks_per_entity = min(num_picks, len(others))
+
+        for name in names:
+            picks = [others[i] for i in rng.choice(len(others), picks_per_entity, replace=False, p=popularity)]
+            picks += [''] * (num_picks - picks_per_entity)
+            filled = rng.rand(num_picks) < fill_rate
+            row = [name] + [pick if keep else '' for pick, keep in zip(picks, filled)]
+            rows.append(row + [entity_type, int(rng.choice(values, p=weights / weights.sum()))])
+
+    columns = ['entity'] + ['choice_' + str(i + 1) for i in range(num_choices)] + \
+              ['backup_' + str(i + 1) for i in range(num_backups)] + ['type', 'importance']
+    return pd.DataFrame(rows, columns=columns).replace('', np.nan)
+
+
+def generate_unavailability(df_event, num_meetings, density=0.05, seed=0):
+    """Each (entity, meeting) is unavailable with probability density; long (entity, meeting) format."""
+    rng = np.random.RandomState(seed)
+    unavailable = rng.rand(len(df_event), num_meetings) < density
+    entity_rows, slots = np.nonzero(unavailable)
+    return pd.DataFrame({'entity': df_event['entity'].values[entity_rows], 'meeting': (slots + 1).astype(str)},
+                        columns=['entity', 'meeting'])
+
+
+def parse_importance(text):
+    # '1:0.5,2:0.3,3:0.2' -> {1: 0.5, 2: 0.3, 3: 0.2}
+    importance = {}
+    for part in text.split(','):
+        value, weight = part.split(':')
+        importance[int(value)] = float(weight)
+    return importance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic event CSV (and optionally its unavailability).')
+    parser.add_argument('output', help='event CSV to write')
+    parser.add_argument('--companies', type=int, default=60)
+    parser.add_argument('--investors', type=int, default=30)
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--backups', type=int, default=2)
+    parser.add_argument('--importance', type=parse_importance, default=None,
+                        help='importance distribution, e.g. 1:0.5,2:0.3,3:0.2')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of target popularity')
+    parser.add_argument('--fill-rate', type=float, default=0.9)
+    parser.add_argument('--unavailability', help='also write an (entity, meeting) unavailability CSV here')
+    parser.add_argument('--density', type=float, default=0.05, help='share of unavailable slots')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df_event = generate_event(args.companies, args.investors, args.choices, args.backups, args.importance,
+                              args.skew, args.fill_rate, args.seed)
+    df_event.to_csv(args.output, index=False)
+    if args.unavailability:
+        generate_unavailability(df_event, args.choices, args.density, args.seed).to_csv(args.unavailability,
+                                                                                         index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class TieCursor(object):
+    """Score groups of df_requests_combined_sorted, computed once at upload.
+
+    The frame is sorted by descending score, so group k is the row slice bounds[k]:bounds[k + 1]. tied[i] is True
+    when row i shares an entity with another row of its group (i.e. it needs a tie-break). position is the next
+    group to fill.
+    """
+
+    def __init__(self, bounds, tied, position=0):
+        self.bounds = bounds
+        self.tied = tied
+        self.position = position
+
+    @classmethod
+    def from_sorted_requests(cls, df_requests_combined_sorted):
+        scores = df_requests_combined_sorted['score'].values
+        starts = np.flatnonzero(np.r_[True, scores[1:] != scores[:-1]]) if len(scores) else np.array([], dtype=int)
+        bounds = np.r_[starts, len(scores)].astype(np.int64)
+
+        group = np.repeat(np.arange(len(starts)), np.diff(bounds))
+        df_groups = df_requests_combined_sorted[['entity1', 'entity2']].assign(group=group)
+        tied = (df_groups.duplicated(subset=['group', 'entity1'], keep=False) |
+                df_groups.duplicated(subset=['group', 'entity2'], keep=False)).values
+
+        return cls(bounds, tied)
+
+    @property
+    def num_groups(self):
+        return len(self.bounds) - 1
+
+    @property
+    def done(self):
+        return self.position >= self.num_groups
+
+    def group_slice(self, k=None):
+        k = self.position if k is None else k
+        return slice(int(self.bounds[k]), int(self.bounds[k + 1]))
+
+    def advance(self):
+        self.position += 1
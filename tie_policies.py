@@ -0,0 +1,84 @@
+import numpy as np
+
+# Automatic tie-break policies. Each one gets the slot engine, the score group and the indices of its tied
+# (schedulable) rows, and returns those indices in the order they should be scheduled -- the same thing an
+# organizer types into the break_ties form. Sorts are stable, so rows that compare equal keep the group order.
+
+
+def _open_slots(mask):
+    return bin(mask).count('1')
+
+
+def same_order(engine, group, tied_inds):
+    # what answering 'SAME' does: keep the order of the sorted request list
+    return list(tied_inds)
+
+
+def _entity_ids(engine, group, tied_inds):
+    # the tied rows' entity IDs from the name arrays; policies run once per component, and most components are a
+    # handful of rows, so a dict lookup per name beats building an indexer each time
+    rows = group.index.get_indexer(tied_inds)
+    ids = engine.ids
+    return ([ids[name] for name in group['entity1'].values[rows]],
+            [ids[name] for name in group['entity2'].values[rows]])
+
+
+def _sort_by(tied_inds, keys):
+    order = sorted(range(len(tied_inds)), key=keys.__getitem__)
+    return [tied_inds[i] for i in order]
+
+
+def fewest_open_slots(engine, group, tied_inds):
+    # pairs whose busiest entity has the fewest open slots left go first
+    masks = engine.free_masks
+    entity1_ids, entity2_ids = _entity_ids(engine, group, tied_inds)
+    return _sort_by(tied_inds, [min(_open_slots(masks[e1]), _open_slots(masks[e2]))
+                                for e1, e2 in zip(entity1_ids, entity2_ids)])
+
+
+def most_constrained(engine, group, tied_inds):
+    # pairs with the fewest slots in common go first, since they are the easiest to squeeze out
+    masks = engine.free_masks
+    entity1_ids, entity2_ids = _entity_ids(engine, group, tied_inds)
+    return _sort_by(tied_inds, [_open_slots(masks[e1] & masks[e2]) for e1, e2 in zip(entity1_ids, entity2_ids)])
+
+
+def mutual_first(engine, group, tied_inds):
+    # meetings both sides asked for go before one-sided requests
+    mutual = (group.loc[tied_inds, 'co_req'] & group.loc[tied_inds, 'inv_req']).values
+    return [ind for ind, m in zip(tied_inds, mutual) if m] + [ind for ind, m in zip(tied_inds, mutual) if not m]
+
+
+def make_random(seed):
+    rng = np.random.RandomState(seed)
+
+    def random_order(engine, group, tied_inds):
+        return [tied_inds[i] for i in rng.permutation(len(tied_inds))]
+
+    return random_order
+
+
+TIE_POLICIES = {
+    'same': 'Keep the request list order',
+    'fewest_open_slots': 'Fewest remaining open slots first',
+    'most_constrained': 'Fewest shared open slots first',
+    'mutual_first': 'Mutual requests first',
+    'random': 'Random (seeded)',
+}
+
+
+def get_tie_policy(name, seed=0):
+    """Return the policy function for name, or None for interactive tie-breaking."""
+    if name is None or name in ('', 'interactive'):
+        return None
+    if name == 'same':
+        return same_order
+    if name == 'fewest_open_slots':
+        return fewest_open_slots
+    if name == 'most_constrained':
+        return most_constrained
+    if name == 'mutual_first':
+        return mutual_first
+    if name == 'random':
+        return make_random(seed)
+    raise ValueError(f'Unknown tie-break policy \'{name}\' (expected one of {", ".join(TIE_POLICIES)}).')
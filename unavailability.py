@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+# Bulk unavailability: a long-format table with one row per (entity, meeting) an attendee can't make, e.g.
+#
+#   entity,meeting
+#   Sample Company,1
+#   Sample Investor,"1,2"
+#
+# A meeting cell may list several meetings separated by commas, and may be written as '2' or 'mtg2'.
+
+
+def read_unavailability(file):
+    df = pd.read_csv(file, dtype=str)
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    if 'entity' not in df.columns or 'meeting' not in df.columns:
+        raise ValueError('The unavailability file needs an \'entity\' and a \'meeting\' column. '
+                         'Please fix it and try again.')
+    return df[['entity', 'meeting']]
+
+
+def expand_unavailability(df_unavailable):
+    """One row per (entity, meeting cell), with the meeting as a 1-based number (NaN where it didn't parse)."""
+    df = df_unavailable.dropna(subset=['entity'])
+    meetings = df['meeting'].fillna('').astype(str).str.split(',')
+    lengths = meetings.str.len().values
+
+    entities = np.repeat(df['entity'].astype(str).str.strip().values, lengths)
+    raw = pd.Series(np.concatenate(meetings.values) if len(meetings) else [], dtype=object).str.strip()
+    numbers = pd.to_numeric(raw.str.lower().str.replace('mtg', ''), errors='coerce')
+    df = pd.DataFrame({'entity': entities, 'meeting': raw.values, 'number': numbers.values})
+    # blank cells and trailing commas don't name a meeting
+    return df[df['meeting'] != '']
+
+
+def apply_unavailability(engine, df_unavailable, label='N/A', evict=False):
+    """Block every listed (entity, meeting) cell in the engine in one go and report the rows that were skipped.
+
+    Cells that already hold a meeting are skipped, unless evict is set: then the meeting is removed first and
+    reported in 'evicted' as an (entity, partner) pair.
+    """
+    df = expand_unavailability(df_unavailable)
+
+    entity_ids = pd.Index(engine.entities).get_indexer(df['entity'].values)
+    numbers = df['number'].values
+    known = entity_ids >= 0
+    in_range = (numbers >= 1) & (numbers <= engine.num_meetings) & (numbers == np.floor(numbers))
+    valid = known & in_range
+
+    slots = numbers[valid].astype(np.int64) - 1
+    evicted = []
+    if evict:
+        for e, slot in zip(entity_ids[valid].tolist(), slots.tolist()):
+            partner = int(engine.assigned[e, slot])
+            if partner >= 0:
+                engine.remove(e, partner, slot)
+                evicted.append((engine.entities[e], engine.entities[partner]))
+    booked = engine.block_many(entity_ids[valid], slots, label)
+
+    return {
+        'blocked': int(valid.sum() - booked.sum()),
+        'unknown_entities': sorted(set(df['entity'].values[~known])),
+        'bad_meetings': sorted(set(df['meeting'].values[known & ~in_range])),
+        'already_booked': [(entity, int(number)) for entity, number in
+                           zip(df['entity'].values[valid][booked], numbers[valid][booked])],
+        'evicted': evicted,
+    }
+
+
+def describe_report(report):
+    """Organizer-facing summary of apply_unavailability()'s report, or None if nothing was skipped."""
+    problems = []
+    if report['unknown_entities']:
+        problems.append('these names don\'t match any entity (spaces matter!): ' +
+                        ', '.join(report['unknown_entities']))
+    if report['bad_meetings']:
+        problems.append('these meetings don\'t exist in your schedule: ' + ', '.join(report['bad_meetings']))
+    if report['already_booked']:
+        problems.append('these slots already hold a meeting and were left alone: ' +
+                        ', '.join(entity + ' mtg' + str(number) for entity, number in report['already_booked']))
+    if not problems:
+        return None
+    return 'Blocked ' + str(report['blocked']) + ' slots, but ' + '; '.join(problems) + '.'
@@ -0,0 +1,69 @@
+import contextlib
+import fcntl
+import os
+import re
+import shutil
+import time
+import uuid
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def job_dir(folder, job_id):
+    # job IDs end up in file paths, so only accept the ones new_job_id() makes
+    if not job_id or not JOB_ID_PATTERN.match(job_id):
+        raise ValueError('Invalid job ID. Please upload your spreadsheet again.')
+    return os.path.join(folder, job_id)
+
+
+def job_path(folder, job_id, filename):
+    return os.path.join(job_dir(folder, job_id), filename)
+
+
+def create_job(folder):
+    job_id = new_job_id()
+    os.makedirs(job_dir(folder, job_id))
+    return job_id
+
+
+@contextlib.contextmanager
+def locked(folder, job_id):
+    """Serialize requests for one job, across threads and gunicorn worker processes."""
+    path = job_dir(folder, job_id)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    with open(os.path.join(path, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield path
+        finally:
+            # the directory mtime marks the job as recently used for collect_stale_jobs()
+            os.utime(path, None)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def collect_stale_jobs(folder, ttl):
+    """Delete job workspaces that haven't been touched for ttl seconds; returns the removed job IDs."""
+    if not os.path.isdir(folder):
+        return []
+
+    cutoff = time.time() - ttl
+    removed = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if not JOB_ID_PATTERN.match(name) or not os.path.isdir(path):
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path)
+                removed.append(name)
+        except FileNotFoundError:
+            # another worker got there first
+            continue
+
+    return removed